@@ -0,0 +1,129 @@
+import tensorflow as tf
+import numpy as np
+import itertools
+import argparse
+import tempfile
+import json
+import os
+from networks import PGGAN
+from benchmark_utils import measure, checksum
+from utils import Struct
+
+# CPU training and generation throughput of the PGGAN networks in each data format
+# the networks of every data format restore the same checkpoint, so their outputs are compared as well
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--output', type=str, default="benchmark_data_format.json")
+parser.add_argument("--data_formats", type=str, nargs="+", default=["NCHW", "NHWC"])
+# the growing stages (resolution `[2, 16] << active_depth`) to benchmark
+parser.add_argument("--active_depths", type=int, nargs="+", default=[2, 4, 6])
+parser.add_argument("--batch_sizes", type=int, nargs="+", default=[8])
+parser.add_argument("--num_batches", type=int, default=10)
+parser.add_argument("--warmup_batches", type=int, default=2)
+parser.add_argument("--device", type=str, default="/cpu:0")
+args = parser.parse_args()
+
+
+def benchmark(data_format, active_depth, batch_size, checkpoint):
+
+    with tf.Graph().as_default(), tf.device(args.device):
+
+        pggan = PGGAN(
+            min_resolution=[2, 16],
+            max_resolution=[128, 1024],
+            min_channels=32,
+            max_channels=256,
+            growing_level=1.0,
+            active_depth=active_depth,
+            data_format=data_format
+        )
+
+        # keep inputs in variables so that neither feeding nor random number generation is measured
+        random = np.random.RandomState(0)
+        resolution = np.asanyarray([2, 16]) << active_depth
+        latents = tf.Variable(random.normal(size=[batch_size, 256]).astype(np.float32), trainable=False)
+        labels = tf.Variable(np.eye(len(range(24, 85)), dtype=np.float32)[random.randint(0, len(range(24, 85)), batch_size)], trainable=False)
+        real_images = tf.Variable(random.uniform(-1.0, 1.0, size=[batch_size, 2, *resolution]).astype(np.float32), trainable=False)
+
+        fake_images = pggan.generator(latents, labels)
+        real_logits = pggan.discriminator(real_images, labels)
+        fake_logits = pggan.discriminator(fake_images, labels)
+
+        # non-saturating loss
+        generator_loss = tf.reduce_mean(tf.nn.softplus(-fake_logits))
+        discriminator_loss = tf.reduce_mean(tf.nn.softplus(-real_logits) + tf.nn.softplus(fake_logits))
+
+        generator_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="generator")
+        discriminator_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="discriminator")
+
+        saver = tf.train.Saver(var_list=generator_variables + discriminator_variables)
+
+        train_op = tf.group(
+            tf.train.AdamOptimizer(1e-4, 0.0, 0.99).minimize(generator_loss, var_list=generator_variables),
+            tf.train.AdamOptimizer(1e-4, 0.0, 0.99).minimize(discriminator_loss, var_list=discriminator_variables)
+        )
+        with tf.control_dependencies([train_op]):
+            train_op = checksum(generator_loss, discriminator_loss)
+        generation_op = checksum(fake_images)
+
+        with tf.Session() as session:
+
+            session.run(tf.global_variables_initializer())
+            # the first data format writes the checkpoint and the others restore it
+            if os.path.exists(f"{checkpoint}.index"):
+                saver.restore(session, checkpoint)
+            else:
+                saver.save(session, checkpoint, write_meta_graph=False)
+
+            # NCHW kernels may be missing on CPU (depending on the build)
+            try:
+                outputs = session.run([fake_images, real_logits])
+                generation = measure(lambda: session.run(generation_op), batch_size, args.num_batches, args.warmup_batches)
+                training = measure(lambda: session.run(train_op), batch_size, args.num_batches, args.warmup_batches)
+            except (tf.errors.UnimplementedError, tf.errors.InvalidArgumentError) as error:
+                tf.logging.warning(f"{data_format}: {error.message}")
+                return Struct(
+                    data_format=data_format,
+                    active_depth=active_depth,
+                    batch_size=batch_size,
+                    error=error.message
+                ), None
+
+    return Struct(
+        data_format=data_format,
+        active_depth=active_depth,
+        resolution=resolution.tolist(),
+        batch_size=batch_size,
+        generation=generation,
+        training=training
+    ), outputs
+
+
+if __name__ == "__main__":
+
+    tf.logging.set_verbosity(tf.logging.INFO)
+
+    results = []
+    with tempfile.TemporaryDirectory() as model_dir:
+        for active_depth, batch_size in itertools.product(args.active_depths, args.batch_sizes):
+
+            checkpoint = os.path.join(model_dir, f"model_{active_depth}_{batch_size}.ckpt")
+
+            reference_outputs = None
+            for data_format in args.data_formats:
+                result, outputs = benchmark(data_format, active_depth, batch_size, checkpoint)
+                # the outputs from the same weights in another data format
+                if outputs is not None:
+                    if reference_outputs is None:
+                        reference_outputs = outputs
+                    result.fake_images_max_difference = np.max(np.abs(outputs[0] - reference_outputs[0]))
+                    result.real_logits_max_difference = np.max(np.abs(outputs[1] - reference_outputs[1]))
+                tf.logging.info(f"{result}")
+                results.append(result)
+
+    with open(args.output, "w") as file:
+        json.dump(dict(
+            device=args.device,
+            num_batches=args.num_batches,
+            results=results
+        ), file, indent=4, default=float)
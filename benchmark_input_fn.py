@@ -0,0 +1,247 @@
+import tensorflow as tf
+import numpy as np
+import itertools
+import argparse
+import json
+import glob
+import os
+from dataset import nsynth_input_fn, nsynth_pcm_input_fn, parse_waveform_example, parse_spectrogram_example
+from dataset import example_predicate, decode_images, read_npy_header
+from spectral_ops import convert_to_spectrogram
+from benchmark_utils import measure
+from utils import Struct
+from tensorflow.contrib.framework.python.ops import audio_ops
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--filenames', type=str, default="nsynth_train-*.tfrecord")
+parser.add_argument('--output', type=str, default="benchmark_input_fn.json")
+parser.add_argument("--batch_sizes", type=int, nargs="+", default=[8, 64])
+# 0 means tf.data.experimental.AUTOTUNE
+parser.add_argument("--num_parallel_calls", type=int, nargs="+", default=[1, 4, 0])
+parser.add_argument("--num_batches", type=int, default=50)
+parser.add_argument("--warmup_batches", type=int, default=5)
+# add the STFT stage (computing spectrograms in the input pipeline as training on waveforms does)
+parser.add_argument('--stft', action="store_true")
+# the storage format: waveform tfrecords (default), spectrogram records or packed PCM shards
+# as read by the training CLIs with the same flags
+parser.add_argument('--spectrograms', action="store_true")
+parser.add_argument("--codec", type=str, default="float32", choices=["float32", "float16", "uint8"])
+parser.add_argument('--pcm', action="store_true")
+# only for the whole `nsynth_input_fn`, the stages read the shards in `--filenames` as they are
+# a cache is filled during its first pass, so cover the dataset with `--warmup_batches` to measure reads from it
+parser.add_argument("--cache_filename", type=str, default=None)
+parser.add_argument("--index_filename", type=str, default=None)
+args = parser.parse_args()
+
+if args.spectrograms and args.pcm:
+    raise ValueError("spectrograms and pcm are exclusive")
+if args.stft and args.spectrograms:
+    raise ValueError("spectrogram records don't need stft")
+if args.cache_filename is not None and args.pcm:
+    raise ValueError("cache_filename is not supported with pcm")
+if args.index_filename and args.spectrograms:
+    raise ValueError("index_filename is not supported with spectrograms")
+
+spectral_params = Struct(
+    waveform_length=64000,
+    sample_rate=16000,
+    spectrogram_shape=[128, 1024],
+    overlap=0.75
+)
+
+
+def stages(batch_size, num_parallel_calls):
+
+    # the stages of `nsynth_input_fn` (or `nsynth_pcm_input_fn`) in pipeline order for the storage format
+    # each one is measured cumulatively on top of the previous ones
+    if args.spectrograms:
+        return [
+            ("parse", lambda dataset: dataset.map(
+                map_func=lambda example: parse_spectrogram_example(example, args.codec),
+                num_parallel_calls=num_parallel_calls
+            )),
+            ("filter", lambda dataset: dataset.filter(
+                predicate=example_predicate(range(24, 85), [0])
+            )),
+            ("decode_images", lambda dataset: dataset.map(
+                map_func=lambda features: decode_images(
+                    images=features.images,
+                    image_shape=[2, 128, 1024],
+                    image_codec=args.codec,
+                    scales=features.get("scales"),
+                    offsets=features.get("offsets")
+                ),
+                num_parallel_calls=num_parallel_calls
+            )),
+            ("batch", lambda dataset: dataset.batch(
+                batch_size=batch_size,
+                drop_remainder=True
+            )),
+        ]
+
+    if args.pcm:
+        # PCM records carry no metadata, the examples are selected against the index before reading
+        waveform_stages = [
+            ("decode_raw", lambda dataset: dataset.map(
+                map_func=lambda record: tf.cast(tf.reshape(tf.decode_raw(record, tf.int16), [64000]), tf.float32) / 32768.0,
+                num_parallel_calls=num_parallel_calls
+            )),
+        ]
+    else:
+        waveform_stages = [
+            ("parse", lambda dataset: dataset.map(
+                map_func=parse_waveform_example,
+                num_parallel_calls=num_parallel_calls
+            )),
+            ("filter", lambda dataset: dataset.filter(
+                predicate=example_predicate(range(24, 85), [0])
+            )),
+            ("read_file", lambda dataset: dataset.map(
+                map_func=lambda features: tf.read_file(features.path),
+                num_parallel_calls=num_parallel_calls
+            )),
+            ("decode_wav", lambda dataset: dataset.map(
+                map_func=lambda contents: tf.squeeze(audio_ops.decode_wav(
+                    contents=contents,
+                    desired_channels=1,
+                    desired_samples=64000
+                )[0]),
+                num_parallel_calls=num_parallel_calls
+            )),
+        ]
+
+    return waveform_stages + [
+        ("batch", lambda dataset: dataset.batch(
+            batch_size=batch_size,
+            drop_remainder=True
+        )),
+    ] + ([
+        ("spectrogram", lambda dataset: dataset.map(
+            map_func=lambda waveforms: tf.stack(convert_to_spectrogram(waveforms, **spectral_params), axis=1),
+            num_parallel_calls=num_parallel_calls
+        )),
+    ] if args.stft else [])
+
+
+def benchmark_stages(filenames, num_stages, batch_size, num_parallel_calls):
+
+    with tf.Graph().as_default():
+
+        if args.pcm:
+            header_lengths = [read_npy_header(filename)[0] for filename in filenames]
+            dataset = tf.data.Dataset.from_tensor_slices((filenames, header_lengths))
+            dataset = dataset.apply(tf.data.experimental.parallel_interleave(
+                map_func=lambda filename, header_length: tf.data.FixedLengthRecordDataset(
+                    filenames=filename,
+                    record_bytes=64000 * 2,
+                    header_bytes=tf.cast(header_length, tf.int64)
+                ),
+                cycle_length=min(len(filenames), os.cpu_count())
+            ))
+        else:
+            dataset = tf.data.Dataset.from_tensor_slices(filenames)
+            dataset = dataset.apply(tf.data.experimental.parallel_interleave(
+                map_func=tf.data.TFRecordDataset,
+                cycle_length=min(len(filenames), os.cpu_count())
+            ))
+        dataset = dataset.repeat()
+
+        def count(num_records):
+            # every stage prefix processes the same records (e.g. the stages after the filter see fewer examples)
+            # so that the differences of their elapsed times are the marginal costs of the stages
+            # and consume the pipeline inside the graph to keep per-element python overhead out of the numbers
+            records = dataset.take(num_records)
+            for _, stage in stages(batch_size, num_parallel_calls)[:num_stages]:
+                records = stage(records)
+            return records.reduce(
+                initial_state=np.int64(0),
+                reduce_func=lambda count, element: count + 1
+            )
+
+        warmup = count(args.warmup_batches * batch_size)
+        counter = count(args.num_batches * batch_size)
+
+        with tf.Session() as session:
+            session.run(warmup)
+            return measure(lambda: session.run(counter), args.num_batches * batch_size)
+
+
+def benchmark_input_fn(filenames, batch_size, num_parallel_calls):
+
+    with tf.Graph().as_default():
+
+        if args.pcm:
+            inputs, labels = nsynth_pcm_input_fn(
+                filenames=filenames,
+                batch_size=batch_size,
+                num_epochs=None,
+                shuffle=False,
+                pitches=range(24, 85),
+                sources=[0],
+                num_parallel_calls=num_parallel_calls,
+                index_filename=args.index_filename
+            )
+        else:
+            inputs, labels = nsynth_input_fn(
+                filenames=filenames,
+                batch_size=batch_size,
+                num_epochs=None,
+                shuffle=False,
+                pitches=range(24, 85),
+                sources=[0],
+                image_shape=[2, 128, 1024] if args.spectrograms else None,
+                num_parallel_calls=num_parallel_calls,
+                cache_filename=args.cache_filename,
+                index_filename=args.index_filename,
+                image_codec=args.codec
+            )
+        outputs = tf.stack(convert_to_spectrogram(inputs, **spectral_params), axis=1) if args.stft else inputs
+
+        with tf.Session() as session:
+            return measure(lambda: session.run(outputs), batch_size, args.num_batches, args.warmup_batches)
+
+
+if __name__ == "__main__":
+
+    tf.logging.set_verbosity(tf.logging.INFO)
+
+    filenames = sorted(glob.glob(args.filenames))
+    # the stage reading the raw records
+    read_stage = "spectrogram_tfrecord" if args.spectrograms else "pcm" if args.pcm else "tfrecord"
+
+    results = []
+    for batch_size, num_parallel_calls in itertools.product(args.batch_sizes, args.num_parallel_calls):
+
+        num_parallel_calls = num_parallel_calls or tf.data.experimental.AUTOTUNE
+
+        stage_results = []
+        for i, (name, _) in enumerate([(read_stage, None)] + stages(batch_size, num_parallel_calls)):
+            stage_result = benchmark_stages(filenames, i, batch_size, num_parallel_calls)
+            stage_result.stage = name
+            # marginal cost of this stage per input record on top of the previous ones
+            stage_result.record_latency_ms = 1000.0 / stage_result.examples_per_sec
+            stage_result.stage_latency_ms = stage_result.record_latency_ms - (stage_results[-1].record_latency_ms if stage_results else 0.0)
+            stage_results.append(stage_result)
+            tf.logging.info(f"batch_size: {batch_size}, num_parallel_calls: {num_parallel_calls}, {stage_result}")
+
+        input_fn_result = benchmark_input_fn(filenames, batch_size, num_parallel_calls)
+        tf.logging.info(f"batch_size: {batch_size}, num_parallel_calls: {num_parallel_calls}, nsynth_input_fn: {input_fn_result}")
+
+        results.append(Struct(
+            batch_size=batch_size,
+            num_parallel_calls=num_parallel_calls,
+            stages=stage_results,
+            nsynth_input_fn=input_fn_result
+        ))
+
+    with open(args.output, "w") as file:
+        json.dump(dict(
+            filenames=filenames,
+            format=read_stage,
+            codec=args.codec if args.spectrograms else None,
+            cache_filename=args.cache_filename,
+            index_filename=args.index_filename,
+            num_batches=args.num_batches,
+            cpu_count=os.cpu_count(),
+            results=results
+        ), file, indent=4)
@@ -0,0 +1,176 @@
+import tensorflow as tf
+import numpy as np
+import itertools
+import argparse
+import json
+import glob
+import sys
+from dataset import nsynth_input_fn
+from spectral_ops import convert_to_spectrogram, convert_to_waveform, cross_correlation
+from benchmark_utils import measure, checksum
+from utils import Struct
+
+parser = argparse.ArgumentParser()
+# falls back to synthetic tones when no tfrecords match
+parser.add_argument('--filenames', type=str, default="nsynth_test-*.tfrecord")
+parser.add_argument('--output', type=str, default="benchmark_spectral_ops.json")
+parser.add_argument('--baseline', type=str, default="")
+parser.add_argument("--spectrogram_shapes", type=str, nargs="+", default=["128x1024", "256x512", "64x2048"])
+parser.add_argument("--overlaps", type=float, nargs="+", default=[0.75, 0.5])
+parser.add_argument("--batch_sizes", type=int, nargs="+", default=[8, 64])
+parser.add_argument("--num_batches", type=int, default=10)
+parser.add_argument("--warmup_batches", type=int, default=2)
+parser.add_argument("--waveform_length", type=int, default=64000)
+parser.add_argument("--sample_rate", type=int, default=16000)
+# relative slowdown and absolute cross-correlation drop reported as regressions
+parser.add_argument("--latency_tolerance", type=float, default=0.1)
+parser.add_argument("--correlation_tolerance", type=float, default=0.001)
+args = parser.parse_args()
+
+
+def load_waveforms(num_examples):
+
+    filenames = sorted(glob.glob(args.filenames))
+
+    if not filenames:
+        # decaying harmonic tones at random pitches
+        random = np.random.RandomState(0)
+        times = np.arange(args.waveform_length) / args.sample_rate
+        pitches = random.randint(24, 85, size=[num_examples, 1, 1])
+        harmonics = np.arange(1, 9)[np.newaxis, :, np.newaxis]
+        phases = random.uniform(0.0, 2.0 * np.pi, size=[num_examples, 8, 1])
+        frequencies = 440.0 * 2.0 ** ((pitches - 69) / 12.0) * harmonics
+        waveforms = np.sum(np.sin(2.0 * np.pi * frequencies * times + phases) / harmonics * (frequencies < args.sample_rate / 2.0), axis=1)
+        waveforms *= np.exp(-times * random.uniform(0.5, 4.0, size=[num_examples, 1])) * 0.25
+        return waveforms.astype(np.float32)
+
+    with tf.Graph().as_default():
+
+        waveforms, _ = nsynth_input_fn(
+            filenames=filenames,
+            batch_size=num_examples,
+            num_epochs=1,
+            shuffle=False,
+            pitches=range(24, 85),
+            sources=[0]
+        )
+
+        with tf.Session() as session:
+            return session.run(waveforms)
+
+
+def benchmark(waveforms, spectrogram_shape, overlap, batch_size):
+
+    spectral_params = Struct(
+        waveform_length=args.waveform_length,
+        sample_rate=args.sample_rate,
+        spectrogram_shape=spectrogram_shape,
+        overlap=overlap
+    )
+
+    with tf.Graph().as_default():
+
+        # keep inputs in variables so that neither feeding nor constant folding is measured
+        originals = tf.Variable(waveforms[:batch_size], trainable=False)
+        magnitude_spectrograms, instantaneous_frequencies = convert_to_spectrogram(originals, **spectral_params)
+        spectrograms = [
+            tf.Variable(tf.zeros_like(magnitude_spectrograms), trainable=False),
+            tf.Variable(tf.zeros_like(instantaneous_frequencies), trainable=False)
+        ]
+        reconstructions = convert_to_waveform(*spectrograms, **spectral_params)
+        cross_correlations = cross_correlation(originals, reconstructions)
+
+        with tf.Session() as session:
+
+            session.run(tf.global_variables_initializer())
+            session.run([
+                tf.assign(spectrograms[0], magnitude_spectrograms),
+                tf.assign(spectrograms[1], instantaneous_frequencies)
+            ])
+
+            forward_checksum = checksum(magnitude_spectrograms, instantaneous_frequencies)
+            inverse_checksum = checksum(reconstructions)
+            forward = measure(lambda: session.run(forward_checksum), batch_size, args.num_batches, args.warmup_batches)
+            inverse = measure(lambda: session.run(inverse_checksum), batch_size, args.num_batches, args.warmup_batches)
+
+            originals_value, reconstructions_value, cross_correlations_value = session.run([originals, reconstructions, cross_correlations])
+
+    return Struct(
+        spectrogram_shape=spectrogram_shape,
+        overlap=overlap,
+        batch_size=batch_size,
+        convert_to_spectrogram=forward,
+        convert_to_waveform=inverse,
+        accuracy=Struct(
+            cross_correlation_mean=np.mean(cross_correlations_value),
+            cross_correlation_min=np.min(cross_correlations_value),
+            cross_correlation_p10=np.percentile(cross_correlations_value, 10),
+            mean_absolute_error=np.mean(np.abs(originals_value - reconstructions_value))
+        )
+    )
+
+
+def compare(results, baseline_results):
+
+    # matching configurations whose speed or fidelity got worse than the baseline
+    baseline_results = {
+        (tuple(result["spectrogram_shape"]), result["overlap"], result["batch_size"]): result
+        for result in baseline_results
+    }
+
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get((tuple(result.spectrogram_shape), result.overlap, result.batch_size))
+        if baseline_result is None:
+            continue
+        for name in ["convert_to_spectrogram", "convert_to_waveform"]:
+            ratio = result[name].latency_ms / baseline_result[name]["latency_ms"]
+            result[name].latency_ratio = ratio
+            if ratio > 1.0 + args.latency_tolerance:
+                regressions.append(f"{name} {result.spectrogram_shape} {result.overlap} {result.batch_size}: {ratio:.2f}x latency")
+        delta = result.accuracy.cross_correlation_mean - baseline_result["accuracy"]["cross_correlation_mean"]
+        result.accuracy.cross_correlation_delta = delta
+        if delta < -args.correlation_tolerance:
+            regressions.append(f"accuracy {result.spectrogram_shape} {result.overlap} {result.batch_size}: {delta:+.4f} cross correlation")
+
+    return regressions
+
+
+if __name__ == "__main__":
+
+    tf.logging.set_verbosity(tf.logging.INFO)
+
+    waveforms = load_waveforms(max(args.batch_sizes))
+
+    results = []
+    for spectrogram_shape, overlap, batch_size in itertools.product(args.spectrogram_shapes, args.overlaps, args.batch_sizes):
+
+        spectrogram_shape = list(map(int, spectrogram_shape.split("x")))
+        time_steps, num_freq_bins = spectrogram_shape
+        frame_length = num_freq_bins * 2
+        frame_step = int((1.0 - overlap) * frame_length)
+        # the spectrogram has to cover the whole waveform
+        if frame_step * (time_steps - 1) + frame_length < args.waveform_length:
+            tf.logging.info(f"skip spectrogram_shape: {spectrogram_shape}, overlap: {overlap} (too short for {args.waveform_length} samples)")
+            continue
+
+        result = benchmark(waveforms, spectrogram_shape, overlap, batch_size)
+        tf.logging.info(f"{result}")
+        results.append(result)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)["results"])
+        for regression in regressions:
+            tf.logging.warning(f"regression: {regression}")
+
+    with open(args.output, "w") as file:
+        json.dump(dict(
+            filenames=sorted(glob.glob(args.filenames)),
+            num_batches=args.num_batches,
+            results=results,
+            regressions=regressions
+        ), file, indent=4, default=float)
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,39 @@
+import tensorflow as tf
+import numpy as np
+import resource
+import time
+import os
+from utils import Struct
+
+# measurement helpers shared by the benchmarks
+
+
+def measure(run, num_examples, num_runs=1, warmup_runs=0):
+
+    # times `num_runs` calls of `run` (each processing `num_examples` examples) after `warmup_runs` untimed ones
+    for _ in range(warmup_runs):
+        run()
+
+    begin_usage = resource.getrusage(resource.RUSAGE_SELF)
+    latencies = []
+    for _ in range(num_runs):
+        begin = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - begin)
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    # user + system time of all threads in this process
+    cpu_time = (end_usage.ru_utime - begin_usage.ru_utime) + (end_usage.ru_stime - begin_usage.ru_stime)
+
+    return Struct(
+        examples_per_sec=num_examples / np.mean(latencies),
+        latency_ms=np.median(latencies) * 1000.0,
+        latency_ms_p90=np.percentile(latencies, 90) * 1000.0,
+        cpu_utilization=cpu_time / np.sum(latencies) / os.cpu_count()
+    )
+
+
+def checksum(*tensors):
+
+    # a scalar that depends on every output to fetch
+    # (grouped ops without consumers get pruned by grappler, full fetches measure host copies)
+    return tf.add_n([tf.reduce_sum(tensor) for tensor in tensors])
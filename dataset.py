@@ -9,83 +9,578 @@ from utils import Struct
 from tensorflow.contrib.framework.python.ops import audio_ops
 
 
-def nsynth_input_fn(filenames, batch_size, num_epochs, shuffle,
-                    buffer_size=None, pitches=None, sources=None):
+def parse_waveform_example(example):
 
-    index_table = tf.contrib.lookup.index_table_from_tensor(sorted(pitches), dtype=tf.int32)
+    features = Struct(tf.parse_single_example(
+        serialized=example,
+        features=dict(
+            path=tf.FixedLenFeature([], dtype=tf.string),
+            pitch=tf.FixedLenFeature([], dtype=tf.int64),
+            source=tf.FixedLenFeature([], dtype=tf.int64)
+        )
+    ))
 
-    def parse_example(example):
+    return features
 
-        features = Struct(tf.parse_single_example(
-            serialized=example,
-            features=dict(
-                path=tf.FixedLenFeature([], dtype=tf.string),
-                pitch=tf.FixedLenFeature([], dtype=tf.int64),
-                source=tf.FixedLenFeature([], dtype=tf.int64)
-            )
-        ))
 
-        waveform = tf.read_file(features.path)
-        # Decode a 16-bit PCM WAV file to a float tensor.
-        # The -32768 to 32767 signed 16-bit values
-        # will be scaled to -1.0 to 1.0 in float.
-        waveform, _ = audio_ops.decode_wav(
-            contents=waveform,
-            desired_channels=1,
-            desired_samples=64000
+def image_feature_name(name, image_resolution=None):
+
+    # features of the lower pyramid levels written by `make_spectrogram_tfrecord.py --pyramid`
+    # are suffixed with their resolution
+    return name if image_resolution is None else "{}_{}x{}".format(name, *image_resolution)
+
+
+def parse_spectrogram_example(example, image_codec="float32", image_resolution=None):
+
+    image_features = dict(
+        images=tf.FixedLenFeature([], dtype=tf.string)
+    )
+    if image_codec == "uint8":
+        # per-plane affine quantization parameters
+        image_features.update(
+            scales=tf.FixedLenFeature([2], dtype=tf.float32),
+            offsets=tf.FixedLenFeature([2], dtype=tf.float32)
         )
-        waveform = tf.squeeze(waveform)
 
-        label = index_table.lookup(features.pitch)
-        label = tf.one_hot(label, len(pitches))
+    # `image_resolution` reads just that pyramid level (returned under the same names)
+    features = tf.parse_single_example(
+        serialized=example,
+        features=dict(
+            pitch=tf.FixedLenFeature([], dtype=tf.int64),
+            source=tf.FixedLenFeature([], dtype=tf.int64),
+            **{image_feature_name(name, image_resolution): feature for name, feature in image_features.items()}
+        )
+    )
+
+    features = Struct(
+        pitch=features["pitch"],
+        source=features["source"],
+        **{name: features[image_feature_name(name, image_resolution)] for name in image_features}
+    )
+
+    return features
+
+
+def read_waveform(path):
+
+    waveform = tf.read_file(path)
+    # Decode a 16-bit PCM WAV file to a float tensor.
+    # The -32768 to 32767 signed 16-bit values
+    # will be scaled to -1.0 to 1.0 in float.
+    waveform, _ = audio_ops.decode_wav(
+        contents=waveform,
+        desired_channels=1,
+        desired_samples=64000
+    )
+    waveform = tf.squeeze(waveform)
+
+    return waveform
+
+
+def decode_images(images, image_shape, image_codec="float32", scales=None, offsets=None):
+
+    # inverse of `make_spectrogram_tfrecord.encode_images`
+    if image_codec == "float32":
+        images = tf.decode_raw(images, tf.float32)
+        images = tf.reshape(images, image_shape)
+    elif image_codec == "float16":
+        images = tf.decode_raw(images, tf.float16)
+        images = tf.reshape(images, image_shape)
+        images = tf.cast(images, tf.float32)
+    elif image_codec == "uint8":
+        images = tf.decode_raw(images, tf.uint8)
+        images = tf.reshape(images, image_shape)
+        images = tf.cast(images, tf.float32)
+        images = images * scales[:, tf.newaxis, tf.newaxis] + offsets[:, tf.newaxis, tf.newaxis]
+    else:
+        raise ValueError(f"invalid image_codec: {image_codec}")
+
+    return images
+
+
+def downscale_images(images, image_resolution):
+
+    # average pooling of [channels, height, width] images as `ops.downscale2d`
+    channels, height, width = images.shape.as_list()
+    if [height, width] == list(image_resolution):
+        return images
+    images = tf.reshape(images, [channels, image_resolution[0], height // image_resolution[0], image_resolution[1], width // image_resolution[1]])
+    images = tf.reduce_mean(images, axis=[2, 4])
+
+    return images
+
+
+def pyramid_resolutions(image_resolution):
+
+    # `image_resolution` and every resolution below it by factors of 2
+    resolutions = [list(image_resolution)]
+    while all(size % 2 == 0 for size in resolutions[-1]):
+        resolutions.append([size // 2 for size in resolutions[-1]])
+
+    return resolutions
+
+
+def load_npz(filename):
+
+    with np.load(filename) as arrays:
+        return Struct({key: arrays[key] for key in arrays.files})
 
-        pitch = tf.cast(features.pitch, tf.int32)
-        source = tf.cast(features.source, tf.int32)
 
-        return waveform, label, pitch, source
+def load_index(filename):
 
-    dataset = tf.data.TFRecordDataset(
-        filenames=filenames
+    # index sidecar written by `make_tfrecord.IndexedTFRecordWriter`
+    index_filename = f"{filename}.index.npz"
+    if not os.path.exists(index_filename):
+        return None
+
+    return load_npz(index_filename)
+
+
+def select_examples(index, pitches=None, sources=None, families=None, velocities=None):
+
+    # resolve a query against index columns to a boolean mask
+    mask = np.ones_like(index.offsets, dtype=bool)
+    if pitches:
+        mask &= (index.pitches >= min(pitches)) & (index.pitches <= max(pitches))
+    if sources:
+        mask &= np.isin(index.sources, sources)
+    if families:
+        mask &= np.isin(index.families, families)
+    if velocities:
+        mask &= np.isin(index.velocities, velocities)
+
+    return mask
+
+
+def pitch_distribution(filenames, pitches, sources=None, index_filename=None, families=None, velocities=None):
+
+    # the empirical distribution of the selected examples over the labels (`sorted(pitches)`)
+    # counted from the columnar index or from the index sidecars of the shards
+    if not index_filename and (families or velocities):
+        raise ValueError("selecting families or velocities requires `index_filename`")
+
+    if index_filename:
+        indices = [load_npz(index_filename)]
+    else:
+        indices = [load_index(filename) for filename in filenames]
+
+    if not indices or any(index is None for index in indices):
+        tf.logging.warning("some shards have no index sidecar, so the pitch distribution falls back to uniform")
+        return np.full(len(pitches), 1.0 / len(pitches))
+
+    counts = sum(
+        np.bincount(
+            np.searchsorted(sorted(pitches), index.pitches[select_examples(index, pitches, sources, families, velocities)]),
+            minlength=len(pitches)
+        ) for index in indices
     )
+
+    return counts / np.sum(counts)
+
+
+def count_records(filename):
+
+    index = load_index(filename)
+    if index is None:
+        return len(list(tf.io.tf_record_iterator(filename)))
+
+    return len(index.offsets)
+
+
+def read_selected_records(filenames, lengths, selections, read_shard, shuffle, num_parallel_reads=None, labels=None):
+
+    # reads each shard sequentially with `read_shard(filename, shard_id)` (a native, saveable dataset)
+    # and keeps just the records selected by `selections`, the index mask over the records of every shard in order
+    # (along with their `labels`)
+    # shards without any selected record aren't read at all
+    begins = np.cumsum(lengths) - lengths
+    shard_ids = [
+        shard_id for shard_id, (begin, length) in enumerate(zip(begins, lengths))
+        if selections[begin:begin + length].any()
+    ]
+    if not shard_ids:
+        raise ValueError("no record matches the selection")
+
+    filenames = tf.constant(np.asarray(filenames))
+    begins = tf.constant(begins, dtype=tf.int64)
+    lengths = tf.constant(lengths, dtype=tf.int64)
+    columns = (tf.constant(selections),) + (() if labels is None else (tf.constant(labels),))
+
+    def read_selected_shard(shard_id):
+
+        begin = tf.gather(begins, shard_id)
+        end = begin + tf.gather(lengths, shard_id)
+
+        dataset = tf.data.Dataset.zip((
+            read_shard(tf.gather(filenames, shard_id), shard_id),
+            tf.data.Dataset.from_tensor_slices(tuple(column[begin:end] for column in columns))
+        ))
+        dataset = dataset.filter(
+            predicate=lambda record, columns: columns[0]
+        )
+        dataset = dataset.map(
+            map_func=lambda record, columns: record if labels is None else (record, columns[1])
+        )
+
+        return dataset
+
+    dataset = tf.data.Dataset.from_tensor_slices(shard_ids)
     if shuffle:
         dataset = dataset.shuffle(
-            buffer_size=buffer_size or sum([
-                len(list(tf.io.tf_record_iterator(filename)))
-                for filename in filenames
-            ]),
+            buffer_size=len(shard_ids),
             reshuffle_each_iteration=True
         )
-    dataset = dataset.repeat(
-        count=num_epochs
-    )
-    dataset = dataset.map(
-        map_func=parse_example,
-        num_parallel_calls=os.cpu_count()
-    )
+    dataset = dataset.apply(tf.data.experimental.parallel_interleave(
+        map_func=read_selected_shard,
+        cycle_length=num_parallel_reads or min(len(shard_ids), os.cpu_count()),
+        sloppy=shuffle
+    ))
+
+    return dataset
+
+
+def example_predicate(pitches=None, sources=None):
+
     # filter just acoustic instruments and just pitches 24-84 (as in the paper)
-    dataset = dataset.filter(
-        predicate=lambda waveform, label, pitch, source: functools.reduce(
+    def predicate(features):
+
+        pitch = tf.cast(features.pitch, tf.int32)
+        source = tf.cast(features.source, tf.int32)
+
+        return functools.reduce(
             tf.logical_and, filter(lambda x: x is not None, [
                 tf.greater_equal(pitch, min(pitches)) if pitches else pitches,
                 tf.less_equal(pitch, max(pitches)) if pitches else pitches,
                 tf.reduce_any(tf.equal(sources, source)) if sources else sources,
-            ])
+            ]), tf.constant(True)
+        )
+
+    return predicate
+
+
+def nsynth_input_fn(filenames, batch_size, num_epochs, shuffle,
+                    buffer_size=None, pitches=None, sources=None, image_shape=None,
+                    num_parallel_reads=None, num_parallel_calls=None, prefetch_buffer_size=None,
+                    save_iterator_state=False, cache_filename=None,
+                    index_filename=None, families=None, velocities=None, image_codec="float32",
+                    num_shards=1, shard_index=0, image_resolution=None, image_pyramid=False):
+
+    # `image_shape` selects records written by `make_spectrogram_tfrecord.py`
+    # which already hold the normalized [2, 128, 1024] spectrogram images
+    # so that the spectral transform drops out of the training loop
+    # `image_codec` has to match the `--codec` they were written with
+    # `num_shards` / `shard_index` select a disjoint part of the input for each data-parallel worker
+    # `image_resolution` yields the images average-pooled to that resolution (e.g. of the current growing stage)
+    # which are read directly from records written with `--pyramid` when `image_pyramid` is set
+
+    # the columnar index points to the waveform records written by `make_tfrecord.py`
+    if index_filename and image_shape:
+        raise ValueError("`index_filename` can't select spectrogram records")
+
+    if image_resolution is not None and not image_shape:
+        raise ValueError("`image_resolution` requires `image_shape`")
+
+    if image_resolution is not None and list(image_resolution) not in pyramid_resolutions(image_shape[1:]):
+        raise ValueError(f"`image_resolution` ({image_resolution}) isn't {image_shape[1:]} divided by a power of 2")
+
+    # the cache holds the whole pyramid computed from the full resolution images
+    # so that it's shared by every growing stage
+    cache_pyramid = image_resolution is not None and cache_filename is not None
+
+    if image_resolution is not None and list(image_resolution) == list(image_shape[1:]):
+        image_resolution = None
+
+    # the pyramid level read from the records
+    read_resolution = image_resolution if image_pyramid and not cache_pyramid else None
+
+    def parse_example(example):
+
+        # parse just the lightweight metadata so that
+        # examples can be filtered before reading audio
+        if image_shape:
+            features = parse_spectrogram_example(example, image_codec, read_resolution)
+        else:
+            features = parse_waveform_example(example)
+
+        return features
+
+    def load_example(features):
+
+        if image_shape:
+            inputs = decode_images(
+                images=features.images,
+                image_shape=[image_shape[0], *(read_resolution or image_shape[1:])],
+                image_codec=image_codec,
+                scales=features.get("scales"),
+                offsets=features.get("offsets")
+            )
+            if cache_pyramid:
+                inputs = tuple(
+                    downscale_images(inputs, resolution)
+                    for resolution in pyramid_resolutions(image_shape[1:])
+                )
+            elif image_resolution and not read_resolution:
+                inputs = downscale_images(inputs, image_resolution)
+        else:
+            inputs = read_waveform(features.path)
+
+        # NOTE: no lookup table here since stateful resources
+        # NOTE: can't be captured by a one-shot (saveable) iterator
+        label = tf.cast(tf.equal(sorted(pitches), tf.cast(features.pitch, tf.int32)), tf.float32)
+
+        return inputs, label
+
+    def cast_example(inputs, label, dtype):
+
+        # `inputs` is the tuple of pyramid levels when the pyramid is cached
+        if isinstance(inputs, tuple):
+            inputs = tuple(tf.cast(level, dtype) for level in inputs)
+        else:
+            inputs = tf.cast(inputs, dtype)
+
+        return inputs, tf.cast(label, dtype)
+
+    def select_level(inputs, label):
+
+        if cache_pyramid:
+            inputs = inputs[pyramid_resolutions(image_shape[1:]).index(list(image_resolution or image_shape[1:]))]
+
+        return cast_example(inputs, label, tf.float32)
+
+    if index_filename:
+        # resolve the query against the columnar index written by `make_tfrecord.py` up front
+        # and keep just the matching records of the shards with any of them
+        index = load_npz(index_filename)
+        mask = select_examples(index, pitches, sources, families, velocities)
+        mask[mask] = np.arange(np.count_nonzero(mask)) % num_shards == shard_index
+        num_records = np.count_nonzero(mask)
+        dataset = read_selected_records(
+            filenames=index.filenames,
+            lengths=np.bincount(index.shards, minlength=len(index.filenames)),
+            # the mask in the order of the records in the shards
+            selections=mask[np.lexsort((index.offsets, index.shards))],
+            read_shard=lambda filename, shard_id: tf.data.TFRecordDataset(filename),
+            shuffle=shuffle,
+            num_parallel_reads=num_parallel_reads
+        )
+    else:
+        if families or velocities:
+            raise ValueError("selecting families or velocities requires `index_filename`")
+        if not filenames:
+            raise ValueError("`filenames` is empty (no files matched)")
+        num_records = None
+        # shard by file when there are enough files and by record otherwise
+        shard_by_file = len(filenames) >= num_shards
+        if shard_by_file:
+            filenames = sorted(filenames)[shard_index::num_shards]
+        # read shards in parallel and let tf.data autotune parallelism and prefetch depth
+        # unless they are given explicitly
+        dataset = tf.data.Dataset.from_tensor_slices(filenames)
+        if shuffle:
+            dataset = dataset.shuffle(
+                buffer_size=len(filenames),
+                reshuffle_each_iteration=True
+            )
+        # when sharding by record, each file is sharded before the (sloppy) interleave
+        # so that the records of each worker are disjoint regardless of the interleave order
+        dataset = dataset.apply(tf.data.experimental.parallel_interleave(
+            map_func=tf.data.TFRecordDataset if shard_by_file else (
+                lambda filename: tf.data.TFRecordDataset(filename).shard(num_shards, shard_index)
+            ),
+            cycle_length=num_parallel_reads or min(len(filenames), os.cpu_count()),
+            sloppy=shuffle
+        ))
+    if cache_filename is None:
+        if shuffle:
+            # a whole-dataset buffer is cheap for waveform records (which hold just paths)
+            # but each spectrogram record is up to 1 MiB, so those are shuffled within a bounded buffer
+            # (after the shards are shuffled and interleaved)
+            dataset = dataset.shuffle(
+                buffer_size=buffer_size or (4096 if image_shape else num_records or sum(map(count_records, filenames))),
+                reshuffle_each_iteration=True
+            )
+        dataset = dataset.repeat(
+            count=num_epochs
+        )
+        dataset = dataset.map(
+            map_func=parse_example,
+            num_parallel_calls=num_parallel_calls or tf.data.experimental.AUTOTUNE
+        )
+        dataset = dataset.filter(
+            predicate=example_predicate(pitches, sources)
+        )
+        dataset = dataset.apply(tf.data.experimental.map_and_batch(
+            map_func=load_example,
+            batch_size=batch_size,
+            num_parallel_calls=num_parallel_calls or tf.data.experimental.AUTOTUNE,
+            drop_remainder=True
+        ))
+    else:
+        # cache decoded examples so that repeated passes over the same split
+        # (e.g. evaluating many checkpoints) skip reading and decoding entirely
+        # the cache is kept in float16 to halve its size
+        # an empty `cache_filename` keeps the cache in memory
+        dataset = dataset.map(
+            map_func=parse_example,
+            num_parallel_calls=num_parallel_calls or tf.data.experimental.AUTOTUNE
         )
+        dataset = dataset.filter(
+            predicate=example_predicate(pitches, sources)
+        )
+        dataset = dataset.map(
+            map_func=lambda features: cast_example(*load_example(features), tf.float16),
+            num_parallel_calls=num_parallel_calls or tf.data.experimental.AUTOTUNE
+        )
+        dataset = dataset.cache(
+            filename=cache_filename
+        )
+        if shuffle:
+            # the cached examples are decoded (up to 1 MiB with the pyramid)
+            # so they are shuffled within a bounded buffer instead of the whole dataset
+            dataset = dataset.shuffle(
+                buffer_size=buffer_size or 4096,
+                reshuffle_each_iteration=True
+            )
+        dataset = dataset.repeat(
+            count=num_epochs
+        )
+        dataset = dataset.apply(tf.data.experimental.map_and_batch(
+            map_func=select_level,
+            batch_size=batch_size,
+            num_parallel_calls=num_parallel_calls or tf.data.experimental.AUTOTUNE,
+            drop_remainder=True
+        ))
+    dataset = dataset.prefetch(
+        buffer_size=prefetch_buffer_size or tf.data.experimental.AUTOTUNE
+    )
+
+    # the pipeline (and its saved state) differs for each `image_resolution`
+    # so each growing stage restores just its own iterator
+    if image_resolution:
+        with tf.name_scope("iterator_{}x{}".format(*image_resolution)):
+            iterator = dataset.make_one_shot_iterator()
+    else:
+        iterator = dataset.make_one_shot_iterator()
+    # save the iterator position and shuffle buffer with the model checkpoints
+    # so that resumed training neither re-warms the shuffle buffer nor re-sees data
+    if save_iterator_state:
+        tf.add_to_collection(tf.GraphKeys.SAVEABLE_OBJECTS, tf.data.experimental.make_saveable_from_iterator(iterator))
+
+    return iterator.get_next()
+
+
+def read_npy_header(filename):
+
+    # the header length and shape of a `.npy` file
+    with open(filename, "rb") as file:
+        major, _ = np.lib.format.read_magic(file)
+        read_array_header = np.lib.format.read_array_header_1_0 if major == 1 else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_array_header(file)
+        if fortran_order or dtype != np.dtype("<i2") or shape[1:] != (64000,):
+            raise ValueError(f"{filename} isn't a shard of int16 64000-sample notes")
+        return file.tell(), shape[0]
+
+
+def nsynth_pcm_input_fn(filenames, batch_size, num_epochs, shuffle,
+                        buffer_size=None, pitches=None, sources=None,
+                        num_parallel_reads=None, num_parallel_calls=None, prefetch_buffer_size=None,
+                        save_iterator_state=False, index_filename=None, families=None, velocities=None,
+                        num_shards=1, shard_index=0):
+
+    # reads packed int16 shards written by `make_tfrecord.py --format pcm`
+    # each shard is read once, sequentially, as fixed-length records after its `.npy` header
+    # (up to its last selected row) and examples are selected against the index mask in the graph
+    # instead of opening a small WAV file (or calling into Python) per example
+
+    if index_filename:
+        index = load_npz(index_filename)
+        filenames = index.filenames
+    else:
+        if families or velocities:
+            raise ValueError("selecting families or velocities requires `index_filename`")
+        if not filenames:
+            raise ValueError("`filenames` is empty (no files matched)")
+        indices = [load_index(filename) for filename in filenames]
+        index = Struct(
+            shards=np.concatenate([np.full_like(shard_index.offsets, i) for i, shard_index in enumerate(indices)]),
+            offsets=np.concatenate([shard_index.offsets for shard_index in indices]),
+            pitches=np.concatenate([shard_index.pitches for shard_index in indices]),
+            sources=np.concatenate([shard_index.sources for shard_index in indices])
+        )
+
+    header_lengths, lengths = map(np.array, zip(*map(read_npy_header, filenames)))
+    begins = np.cumsum(lengths) - lengths
+    record_bytes = 64000 * 2
+
+    # filter on the index so that nothing is decoded for the other examples
+    mask = select_examples(index, pitches, sources, families, velocities)
+
+    # the labels of every row of the shards in order
+    rows = begins[index.shards] + index.offsets
+    labels = np.zeros(np.sum(lengths), dtype=np.int64)
+    labels[rows[mask]] = np.searchsorted(sorted(pitches), index.pitches[mask])
+
+    # each data-parallel worker takes a contiguous block of the selected rows
+    # so that it reads (mostly) whole shards of its own
+    worker_rows = np.array_split(np.sort(rows[mask]), num_shards)[shard_index]
+    selections = np.zeros(np.sum(lengths), dtype=bool)
+    selections[worker_rows] = True
+
+    # the rows after the last selected row of each shard are cut off as its footer (which isn't read)
+    last_rows = np.full(len(lengths), -1)
+    worker_shards = np.searchsorted(begins, worker_rows, side="right") - 1
+    np.maximum.at(last_rows, worker_shards, worker_rows - begins[worker_shards])
+
+    header_lengths = tf.constant(header_lengths, dtype=tf.int64)
+    footer_lengths = tf.constant((lengths - last_rows - 1) * record_bytes, dtype=tf.int64)
+
+    def load_example(record, label):
+
+        waveform = tf.decode_raw(record, tf.int16)
+        waveform = tf.reshape(waveform, [64000])
+        # scale to -1.0 to 1.0 in float as `decode_wav` does
+        waveform = tf.cast(waveform, tf.float32) / 32768.0
+
+        label = tf.one_hot(label, len(pitches))
+
+        return waveform, label
+
+    dataset = read_selected_records(
+        filenames=filenames,
+        lengths=lengths,
+        selections=selections,
+        read_shard=lambda filename, shard_id: tf.data.FixedLengthRecordDataset(
+            filenames=filename,
+            record_bytes=record_bytes,
+            header_bytes=tf.gather(header_lengths, shard_id),
+            footer_bytes=tf.gather(footer_lengths, shard_id)
+        ),
+        shuffle=shuffle,
+        num_parallel_reads=num_parallel_reads,
+        labels=labels
     )
-    dataset = dataset.map(
-        map_func=lambda waveform, label, pitch, source: (waveform, label),
-        num_parallel_calls=os.cpu_count()
+    if shuffle:
+        # each record is 125 KiB, so they are shuffled within a bounded buffer
+        # (after the shards are shuffled and interleaved)
+        dataset = dataset.shuffle(
+            buffer_size=buffer_size or 4096,
+            reshuffle_each_iteration=True
+        )
+    dataset = dataset.repeat(
+        count=num_epochs
     )
-    dataset = dataset.batch(
+    dataset = dataset.apply(tf.data.experimental.map_and_batch(
+        map_func=load_example,
         batch_size=batch_size,
+        num_parallel_calls=num_parallel_calls or tf.data.experimental.AUTOTUNE,
         drop_remainder=True
-    )
+    ))
     dataset = dataset.prefetch(
-        buffer_size=1
+        buffer_size=prefetch_buffer_size or tf.data.experimental.AUTOTUNE
     )
 
-    iterator = dataset.make_initializable_iterator()
-    tf.add_to_collection(tf.GraphKeys.TABLE_INITIALIZERS, iterator.initializer)
-    # tf.add_to_collection(tf.GraphKeys.SAVEABLE_OBJECTS, tf.data.experimental.make_saveable_from_iterator(iterator))
+    iterator = dataset.make_one_shot_iterator()
+    if save_iterator_state:
+        tf.add_to_collection(tf.GraphKeys.SAVEABLE_OBJECTS, tf.data.experimental.make_saveable_from_iterator(iterator))
 
     return iterator.get_next()
@@ -0,0 +1,112 @@
+import tensorflow as tf
+import numpy as np
+import argparse
+from networks import PGGAN
+from ops import upscale2d
+from spectral_ops import convert_to_waveform
+from utils import Struct
+
+# exports the generator of a GANSynth checkpoint as a frozen inference graph
+# (`latents` [N, 256] and MIDI `pitches` [N] to `images` [N, 2, H, W] and `waveforms` [N, 64000])
+# only the fully grown path of the stage is built (no `tf.cond`s, fade-ins or lower resolution color blocks)
+# and the equalized learning rate scaling of every weight is folded into its constant
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--model_dir", type=str, default="gan_synth_model")
+parser.add_argument("--checkpoint", type=str, default=None)
+# the growing stage to export (e.g. the latest stage of `--native_resolution` training), fully grown by default
+parser.add_argument("--active_depth", type=int, default=None)
+# the layout of the feature maps in the networks (NHWC for CPU), checkpoints are compatible across layouts
+parser.add_argument("--data_format", type=str, default="NCHW", choices=["NCHW", "NHWC"])
+parser.add_argument("--output", type=str, default="gan_synth_generator.pb")
+parser.add_argument("--saved_model_dir", type=str, default="")
+args = parser.parse_args()
+
+tf.logging.set_verbosity(tf.logging.INFO)
+
+spectral_params = Struct(
+    waveform_length=64000,
+    sample_rate=16000,
+    spectrogram_shape=[128, 1024],
+    overlap=0.75
+)
+
+with tf.Graph().as_default() as graph:
+
+    pggan = PGGAN(
+        min_resolution=[2, 16],
+        max_resolution=[128, 1024],
+        min_channels=32,
+        max_channels=256,
+        growing_level=None,
+        active_depth=args.active_depth,
+        data_format=args.data_format
+    )
+
+    latents = tf.placeholder(tf.float32, [None, 256], name="latents")
+    pitches = tf.placeholder(tf.int32, [None], name="pitches")
+    labels = tf.one_hot(pitches - 24, len(range(24, 85)))
+
+    images = pggan.generator(latents, labels)
+    images = tf.identity(images, name="images")
+
+    # the images of a lower resolution stage are upscaled to the full resolution for the waveforms
+    factors = np.asanyarray(spectral_params.spectrogram_shape) // np.asanyarray(images.shape[2:].as_list())
+    waveforms = convert_to_waveform(*tf.unstack(upscale2d(images, factors), axis=1), **spectral_params)
+    waveforms = tf.identity(waveforms, name="waveforms")
+
+    output_names = ["images", "waveforms"]
+
+    # `weight * stddev` of every layer built with `scale_weight=True`
+    scaled_weights = [operation.outputs[0] for operation in graph.get_operations() if operation.name.endswith("/scaled_weight")]
+
+    saver = tf.train.Saver(var_list=tf.global_variables(scope="generator"))
+
+    with tf.Session() as session:
+
+        checkpoint = args.checkpoint or tf.train.latest_checkpoint(args.model_dir)
+        saver.restore(session, checkpoint)
+
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            sess=session,
+            input_graph_def=graph.as_graph_def(),
+            output_node_names=output_names
+        )
+        scaled_weight_values = session.run(scaled_weights)
+
+# replace each `weight * stddev` with the constant of its value
+# and prune the unscaled weights (and the identities of the variable reads)
+with tf.Graph().as_default():
+    constants = {
+        scaled_weight.op.name: tf.constant(value, name=scaled_weight.op.name).op.node_def
+        for scaled_weight, value in zip(scaled_weights, scaled_weight_values)
+    }
+
+for node in graph_def.node:
+    if node.name in constants:
+        node.CopyFrom(constants[node.name])
+
+graph_def = tf.graph_util.extract_sub_graph(graph_def, output_names)
+graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=output_names)
+
+tf.logging.info(f"exported {len(graph_def.node)} nodes from {checkpoint} to {args.output}")
+
+with open(args.output, "wb") as file:
+    file.write(graph_def.SerializeToString())
+
+if args.saved_model_dir:
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name="")
+        with tf.Session() as session:
+            tf.saved_model.simple_save(
+                session=session,
+                export_dir=args.saved_model_dir,
+                inputs=dict(
+                    latents=graph.get_tensor_by_name("latents:0"),
+                    pitches=graph.get_tensor_by_name("pitches:0")
+                ),
+                outputs=dict(
+                    images=graph.get_tensor_by_name("images:0"),
+                    waveforms=graph.get_tensor_by_name("waveforms:0")
+                )
+            )
@@ -15,19 +15,54 @@ import numpy as np
 import functools
 import argparse
 import glob
-from dataset import nsynth_input_fn
+from dataset import nsynth_input_fn, nsynth_pcm_input_fn, pitch_distribution
 from models import GANSynth
 from networks import PGGAN
 from utils import Struct
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--model_dir", type=str, default="gan_synth_model")
-parser.add_argument('--filenames', type=str, default="nsynth*.tfrecord")
+parser.add_argument('--filenames', type=str, default="nsynth_train-*.tfrecord")
 parser.add_argument("--batch_size", type=int, default=8)
+# batch size of each growing stage (from the lowest resolution) with `--native_resolution`
+# the growing schedule (`--growing_steps` and `--total_steps`) stays defined in steps of `--batch_size`
+parser.add_argument("--batch_sizes", type=int, nargs="+", default=None)
+# gradients are averaged over `accumulation_steps` micro-batches of `batch_size` per update
+parser.add_argument("--accumulation_steps", type=int, default=1)
+# apply the gradient penalty and the mode-seeking loss every `regularization_interval` steps (lazy regularization)
+parser.add_argument("--regularization_interval", type=int, default=1)
 parser.add_argument("--num_epochs", type=int, default=None)
+# the shuffle buffer size in examples (the whole dataset for waveform records, 4096 for spectrogram records by default)
+parser.add_argument("--buffer_size", type=int, default=None)
+# save the input iterator (its position and shuffle buffer) with every checkpoint so that resumed training doesn't re-see data
+# the shuffle buffer is written into each checkpoint, so keep `--buffer_size` small with it
+parser.add_argument('--save_iterator_state', action="store_true")
 parser.add_argument("--total_steps", type=int, default=1000000)
 parser.add_argument("--growing_steps", type=int, default=1000000)
+# build a graph per growing stage at its own resolution instead of a single graph at the full resolution
+parser.add_argument('--native_resolution', action="store_true")
 parser.add_argument('--classifier', type=str, default="pitch_classifier.pb")
+parser.add_argument('--spectrograms', action="store_true")
+parser.add_argument("--codec", type=str, default="float32", choices=["float32", "float16", "uint8"])
+# the spectrogram records hold every resolution (`make_spectrogram_tfrecord.py --pyramid`)
+parser.add_argument('--pyramid', action="store_true")
+parser.add_argument('--pcm', action="store_true")
+# the layout of the feature maps in the networks (NHWC for CPU), checkpoints are compatible across layouts
+parser.add_argument("--data_format", type=str, default="NCHW", choices=["NCHW", "NHWC"])
+parser.add_argument("--num_parallel_reads", type=int, default=None)
+parser.add_argument("--num_parallel_calls", type=int, default=None)
+parser.add_argument("--prefetch_buffer_size", type=int, default=None)
+parser.add_argument("--cache_filename", type=str, default=None)
+parser.add_argument("--index_filename", type=str, default=None)
+parser.add_argument("--families", type=int, nargs="+", default=None)
+parser.add_argument("--velocities", type=int, nargs="+", default=None)
+# run the discriminator and generator updates in a single `session.run`
+parser.add_argument('--fused_train_step', action="store_true")
+# between-graph replicated data-parallel training (see `launch_local_cluster.py`)
+parser.add_argument("--job_name", type=str, default="", choices=["", "ps", "worker"])
+parser.add_argument("--task_index", type=int, default=0)
+parser.add_argument("--ps_hosts", type=str, nargs="+", default=[])
+parser.add_argument("--worker_hosts", type=str, nargs="+", default=[])
 parser.add_argument('--train', action="store_true")
 parser.add_argument('--evaluate', action="store_true")
 parser.add_argument('--generate', action="store_true")
@@ -35,35 +70,166 @@ args = parser.parse_args()
 
 tf.logging.set_verbosity(tf.logging.INFO)
 
-with tf.Graph().as_default():
+if args.job_name:
+    cluster = tf.train.ClusterSpec(dict(
+        ps=args.ps_hosts,
+        worker=args.worker_hosts
+    ))
+    server = tf.train.Server(
+        server_or_cluster_def=cluster,
+        job_name=args.job_name,
+        task_index=args.task_index
+    )
+    if args.job_name == "ps":
+        server.join()
+    master = server.target
+    num_workers = len(args.worker_hosts)
+    # variables on the parameter servers and everything else on this worker
+    device_setter = tf.train.replica_device_setter(
+        worker_device=f"/job:worker/task:{args.task_index}",
+        cluster=cluster
+    )
+else:
+    master = ""
+    num_workers = 1
+    device_setter = None
+
+# resolution-native progressive growing
+# `PGGAN.growing_depth` (with `growing_level = global_step / growing_steps`) passes depth `d` after step
+# `(2 ** d - 1) * growing_steps / (2 ** (max_depth + 1) - 1)`, so the stage at depth `d` trains until that step
+# and each stage is trained in its own graph, restored from the checkpoint of the previous stage
+# with a batch size for each stage, the schedule is kept in examples (steps of `batch_size`)
+# so that larger batches at low resolutions finish their stages in fewer steps
+if args.native_resolution:
+    if num_workers > 1:
+        raise ValueError("native_resolution is not supported with multiple workers")
+    max_depth = int(np.log2(1024 // 16))
+    batch_sizes = args.batch_sizes or [args.batch_size] * (max_depth + 1)
+    if len(batch_sizes) != max_depth + 1:
+        raise ValueError(f"batch_sizes needs one batch size for each of the {max_depth + 1} growing stages")
+    stages = []
+    first_step = 0
+    first_example = 0
+    for depth, batch_size in enumerate(batch_sizes):
+        last_step = (2 ** depth - 1) * args.growing_steps // (2 ** (max_depth + 1) - 1) + 1 if depth < max_depth else args.total_steps
+        last_example = min(last_step, args.total_steps) * args.batch_size
+        num_steps = -(-(last_example - first_example) // batch_size)
+        stages.append(Struct(
+            active_depth=depth,
+            batch_size=batch_size,
+            first_step=first_step,
+            first_example=first_example,
+            last_step=first_step + num_steps
+        ))
+        first_step += num_steps
+        first_example = last_example
+else:
+    if args.batch_sizes:
+        raise ValueError("batch_sizes requires native_resolution")
+    stages = [Struct(
+        active_depth=None,
+        batch_size=args.batch_size,
+        first_step=0,
+        first_example=0,
+        last_step=args.total_steps
+    )]
+
+# `batch_stddev` in the discriminator computes statistics over groups of 4 examples within each micro-batch
+# (or the whole micro-batch when it's smaller)
+for stage in stages:
+    if stage.batch_size % min(4, stage.batch_size):
+        raise ValueError(f"batch_size ({stage.batch_size}) must be a multiple of the batch_stddev groups (4)")
+
+
+# generator labels are sampled from the empirical pitch distribution of the training data
+# so that the fake label marginals match the real ones
+pitch_probabilities = pitch_distribution(
+    filenames=glob.glob(args.filenames),
+    pitches=range(24, 85),
+    sources=[0],
+    index_filename=args.index_filename,
+    families=args.families,
+    velocities=args.velocities
+) if args.train else None
+
+
+def build(stage, evaluation=False):
 
     tf.set_random_seed(0)
 
+    # the fraction of the growing schedule in examples (`global_step / growing_steps` with a single batch size)
     pggan = PGGAN(
         min_resolution=[2, 16],
         max_resolution=[128, 1024],
         min_channels=32,
         max_channels=256,
         growing_level=tf.cast(tf.divide(
-            x=tf.train.create_global_step(),
-            y=args.growing_steps
-        ), tf.float32)
+            x=stage.first_example + (tf.train.create_global_step() - stage.first_step) * stage.batch_size,
+            y=args.growing_steps * args.batch_size
+        ), tf.float32),
+        active_depth=stage.active_depth,
+        data_format=args.data_format
     )
 
-    gan_synth = GANSynth(
-        generator=pggan.generator,
-        discriminator=pggan.discriminator,
-        real_input_fn=functools.partial(
+    if args.pcm:
+        real_input_fn = functools.partial(
+            nsynth_pcm_input_fn,
+            filenames=glob.glob(args.filenames),
+            batch_size=stage.batch_size,
+            num_epochs=args.num_epochs if args.train else 1,
+            shuffle=True if args.train else False,
+            buffer_size=args.buffer_size,
+            pitches=range(24, 85),
+            sources=[0],
+            num_parallel_reads=args.num_parallel_reads,
+            num_parallel_calls=args.num_parallel_calls,
+            prefetch_buffer_size=args.prefetch_buffer_size,
+            save_iterator_state=args.save_iterator_state and args.train and num_workers == 1,
+            index_filename=args.index_filename,
+            families=args.families,
+            velocities=args.velocities,
+            num_shards=num_workers,
+            shard_index=args.task_index
+        )
+    else:
+        real_input_fn = functools.partial(
             nsynth_input_fn,
             filenames=glob.glob(args.filenames),
-            batch_size=args.batch_size,
+            batch_size=stage.batch_size,
             num_epochs=args.num_epochs if args.train else 1,
             shuffle=True if args.train else False,
+            buffer_size=args.buffer_size,
             pitches=range(24, 85),
-            sources=[0]
-        ),
+            sources=[0],
+            image_shape=[2, 128, 1024] if args.spectrograms else None,
+            num_parallel_reads=args.num_parallel_reads,
+            num_parallel_calls=args.num_parallel_calls,
+            prefetch_buffer_size=args.prefetch_buffer_size,
+            save_iterator_state=args.save_iterator_state and args.train and num_workers == 1,
+            cache_filename=args.cache_filename,
+            index_filename=args.index_filename,
+            families=args.families,
+            velocities=args.velocities,
+            image_codec=args.codec,
+            num_shards=num_workers,
+            shard_index=args.task_index,
+            # with resolution-native progressive growing the images are downscaled (or read) at the resolution of the stage
+            # except in evaluation where the classifier takes the full resolution real images
+            image_resolution=(np.asanyarray([2, 16]) << stage.active_depth).tolist() if args.spectrograms and stage.active_depth is not None and not evaluation else None,
+            image_pyramid=args.pyramid
+        )
+
+    return GANSynth(
+        generator=pggan.generator,
+        discriminator=pggan.discriminator,
+        real_input_fn=real_input_fn,
+        # in evaluation the fake images are generated with the labels of the real batch
         fake_input_fn=lambda: (
-            tf.random.normal([args.batch_size, 256])
+            tf.random.normal([stage.batch_size, 256]),
+            None if evaluation else tf.one_hot(tf.reshape(tf.random.categorical(
+                logits=tf.log(pitch_probabilities[np.newaxis]),
+                num_samples=stage.batch_size
+            ), [stage.batch_size]), len(range(24, 85)))
         ),
         spectral_params=Struct(
             waveform_length=64000,
@@ -74,35 +240,61 @@ with tf.Graph().as_default():
         # [Don't Decay the Learning Rate, Increase the Batch Size]
         # (https://arxiv.org/pdf/1711.00489.pdf)
         hyper_params=Struct(
-            generator_learning_rate=8e-4 * args.batch_size / 8,
+            generator_learning_rate=8e-4 * stage.batch_size * args.accumulation_steps * num_workers / 8,
             generator_beta1=0.0,
             generator_beta2=0.99,
-            discriminator_learning_rate=8e-4 * args.batch_size / 8,
+            discriminator_learning_rate=8e-4 * stage.batch_size * args.accumulation_steps * num_workers / 8,
             discriminator_beta1=0.0,
             discriminator_beta2=0.99,
             mode_seeking_loss_weight=0.1,
             real_gradient_penalty_weight=5.0,
             fake_gradient_penalty_weight=0.0,
+            fused_train_step=args.fused_train_step,
+            accumulation_steps=args.accumulation_steps,
+            regularization_interval=args.regularization_interval,
+            num_workers=num_workers
         )
     )
 
-    config = tf.ConfigProto(
-        gpu_options=tf.GPUOptions(
-            allow_growth=True
-        )
+
+config = tf.ConfigProto(
+    gpu_options=tf.GPUOptions(
+        allow_growth=True
     )
+)
 
-    if args.train:
-        gan_synth.train(
-            model_dir=args.model_dir,
-            config=config,
-            total_steps=args.total_steps,
-            save_checkpoint_steps=1000,
-            save_summary_steps=100,
-            log_tensor_steps=100
-        )
+checkpoint = tf.train.latest_checkpoint(args.model_dir)
+global_step = tf.train.load_variable(checkpoint, "global_step") if checkpoint else 0
+
+if args.train:
+    for stage in stages:
+        if global_step >= stage.last_step:
+            continue
+        with tf.Graph().as_default(), tf.device(device_setter):
+            gan_synth = build(stage)
+            gan_synth.train(
+                model_dir=args.model_dir,
+                config=config,
+                total_steps=stage.last_step,
+                save_checkpoint_steps=1000,
+                save_summary_steps=100,
+                log_tensor_steps=100,
+                master=master,
+                is_chief=args.task_index == 0,
+                # a stage starting from the checkpoint of the previous stage adds the blocks at its resolution
+                new_variable_scopes=[
+                    "{}_{}x{}".format(block, *(np.asanyarray([2, 16]) << stage.active_depth))
+                    for block in ["conv_block", "color_block"]
+                ] if stage.active_depth and global_step == stage.first_step else None
+            )
+        global_step = stage.last_step
+
+if args.evaluate:
+    # evaluate the stage of the latest checkpoint
+    stage = next((stage for stage in stages if global_step <= stage.last_step), stages[-1])
+    with tf.Graph().as_default(), tf.device(device_setter):
 
-    if args.evaluate:
+        gan_synth = build(stage, evaluation=True)
 
         with open(args.classifier, "rb") as file:
             classifier = tf.GraphDef.FromString(file.read())
@@ -0,0 +1,56 @@
+import subprocess
+import argparse
+import time
+import sys
+
+# runs a training script as a localhost cluster of parameter servers and workers
+# e.g. python launch_local_cluster.py --num_workers 2 gan_synth_main.py --fused_train_step --train
+# on many nodes, run the script on each node with the same `--ps_hosts` / `--worker_hosts`
+# and its own `--job_name` / `--task_index` instead
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--num_workers", type=int, default=2)
+parser.add_argument("--num_ps", type=int, default=1)
+parser.add_argument("--base_port", type=int, default=2222)
+parser.add_argument("script", type=str)
+parser.add_argument("script_args", nargs=argparse.REMAINDER)
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    ps_hosts = [f"localhost:{args.base_port + i}" for i in range(args.num_ps)]
+    worker_hosts = [f"localhost:{args.base_port + args.num_ps + i}" for i in range(args.num_workers)]
+
+    def launch(job_name, task_index):
+        return subprocess.Popen([
+            sys.executable, args.script, *args.script_args,
+            "--job_name", job_name,
+            "--task_index", str(task_index),
+            "--ps_hosts", *ps_hosts,
+            "--worker_hosts", *worker_hosts
+        ])
+
+    ps_processes = [launch("ps", task_index) for task_index in range(args.num_ps)]
+    worker_processes = [launch("worker", task_index) for task_index in range(args.num_workers)]
+
+    processes = ps_processes + worker_processes
+
+    try:
+        # poll every process until the workers finish or any process fails
+        # then stop the others, which would otherwise block on the failed one forever
+        while True:
+            returncode = next((process.poll() for process in processes if process.poll()), 0)
+            if returncode or all(process.poll() is not None for process in worker_processes):
+                break
+            time.sleep(1.0)
+    finally:
+        # parameter servers serve until they are killed
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
+
+    # the return code of the first failure found (a negative one is the signal that killed the process, 128 + N as in shells)
+    sys.exit(returncode if returncode >= 0 else 128 - returncode)
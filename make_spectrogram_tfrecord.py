@@ -0,0 +1,155 @@
+import tensorflow as tf
+import numpy as np
+import itertools
+import argparse
+import glob
+import os
+from dataset import parse_waveform_example, read_waveform, example_predicate, pyramid_resolutions, image_feature_name
+from make_tfrecord import IndexedTFRecordWriter
+from spectral_ops import convert_to_spectrogram
+from utils import Struct
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--filenames', type=str, default="nsynth_train-*.tfrecord")
+parser.add_argument('--output', type=str, default="nsynth_train_spectrogram")
+parser.add_argument("--num_shards", type=int, default=8)
+# float16 halves and uint8 quarters the size of a float32 image
+parser.add_argument("--codec", type=str, default="float32", choices=["float32", "float16", "uint8"])
+# also write the images average-pooled to every lower resolution (by factors of 2)
+# so that `nsynth_input_fn(image_resolution=..., image_pyramid=True)` reads just the level it needs (about 1/3 more storage)
+parser.add_argument('--pyramid', action="store_true")
+args = parser.parse_args()
+
+
+def encode_images(images, codec):
+
+    # returns the image bytes and any extra float features needed to decode them
+    # (see `dataset.decode_images`)
+    if codec == "float32":
+        return images.astype(np.float32).tobytes(), {}
+    if codec == "float16":
+        return images.astype(np.float16).tobytes(), {}
+
+    # per-plane affine quantization over each plane's own range
+    # so that both the log-mel magnitude and the IF plane use all 256 levels
+    minimums = np.min(images, axis=(1, 2))
+    maximums = np.max(images, axis=(1, 2))
+    scales = np.maximum(maximums - minimums, np.finfo(np.float32).tiny) / 255.0
+    quantized = np.round((images - minimums[:, np.newaxis, np.newaxis]) / scales[:, np.newaxis, np.newaxis])
+
+    return np.clip(quantized, 0, 255).astype(np.uint8).tobytes(), dict(scales=scales, offsets=minimums)
+
+
+def encode_pyramid(images, codec, pyramid):
+
+    # returns the bytes and decoding features of every pyramid level (or just the full resolution)
+    # keyed as `dataset.parse_spectrogram_example` expects them
+    # (the full resolution level keeps the unsuffixed names)
+    channels, height, width = images.shape
+    features = {}
+    for resolution in pyramid_resolutions([height, width]) if pyramid else [[height, width]]:
+        level = images.reshape([channels, resolution[0], height // resolution[0], resolution[1], width // resolution[1]]).mean(axis=(2, 4))
+        level_bytes, decoding_params = encode_images(level, codec)
+        level_resolution = None if resolution == [height, width] else resolution
+        features[image_feature_name("images", level_resolution)] = level_bytes
+        features.update({
+            image_feature_name(name, level_resolution): value
+            for name, value in decoding_params.items()
+        })
+
+    return features
+
+
+if __name__ == "__main__":
+
+    # compute the normalized log-mel magnitude / IF images once
+    # and write them to sharded storage consumed by `nsynth_input_fn(image_shape=...)`
+
+    pitches = range(24, 85)
+    sources = [0]
+
+    spectral_params = Struct(
+        waveform_length=64000,
+        sample_rate=16000,
+        spectrogram_shape=[128, 1024],
+        overlap=0.75
+    )
+
+    def convert_example(features):
+        waveform = read_waveform(features.path)
+        magnitude_spectrogram, instantaneous_frequency = convert_to_spectrogram(waveform[tf.newaxis], **spectral_params)
+        images = tf.concat([magnitude_spectrogram, instantaneous_frequency], axis=0)
+        return images, features.pitch, features.source
+
+    # sorted so that the contents and the order of the shards don't depend on the file system
+    filenames = sorted(glob.glob(args.filenames))
+    if not filenames:
+        raise ValueError(f"no files match `--filenames` ({args.filenames})")
+
+    dataset = tf.data.TFRecordDataset(
+        filenames=filenames
+    )
+    dataset = dataset.map(
+        map_func=parse_waveform_example,
+        num_parallel_calls=os.cpu_count()
+    )
+    dataset = dataset.filter(
+        predicate=example_predicate(pitches, sources)
+    )
+    dataset = dataset.map(
+        map_func=convert_example,
+        num_parallel_calls=os.cpu_count()
+    )
+    dataset = dataset.prefetch(
+        buffer_size=os.cpu_count()
+    )
+
+    images, pitch, source = dataset.make_one_shot_iterator().get_next()
+
+    writers = [
+        IndexedTFRecordWriter(f"{args.output}-{shard:05d}-of-{args.num_shards:05d}.tfrecord")
+        for shard in range(args.num_shards)
+    ]
+
+    with tf.Session() as session:
+
+        for index in itertools.count():
+            try:
+                images_value, pitch_value, source_value = session.run([images, pitch, source])
+            except tf.errors.OutOfRangeError:
+                break
+            image_features = encode_pyramid(images_value, args.codec, args.pyramid)
+            writers[index % args.num_shards].write(
+                record=tf.train.Example(
+                    features=tf.train.Features(
+                        feature=dict(
+                            pitch=tf.train.Feature(
+                                int64_list=tf.train.Int64List(
+                                    value=[pitch_value]
+                                )
+                            ),
+                            source=tf.train.Feature(
+                                int64_list=tf.train.Int64List(
+                                    value=[source_value]
+                                )
+                            ),
+                            **{
+                                name: tf.train.Feature(
+                                    bytes_list=tf.train.BytesList(
+                                        value=[value]
+                                    )
+                                ) if isinstance(value, bytes) else tf.train.Feature(
+                                    float_list=tf.train.FloatList(
+                                        value=value
+                                    )
+                                ) for name, value in image_features.items()
+                            }
+                        )
+                    )
+                ).SerializeToString(),
+                pitch=pitch_value,
+                source=source_value
+            )
+
+    for writer in writers:
+        writer.close()
@@ -1,48 +1,299 @@
 import tensorflow as tf
+import numpy as np
+import multiprocessing
+import argparse
 import pathlib
-import random
+import hashlib
+import zipfile
+import io
 import json
+import wave
+from utils import Struct
 
 
-if __name__ == "__main__":
+def save_npz(filename, **arrays):
+
+    # `np.savez` with fixed zip metadata (`np.savez` stamps each member with the current time)
+    # so that rerunning with the same inputs writes byte-identical files
+    with zipfile.ZipFile(filename, "w") as file:
+        for name, array in arrays.items():
+            buffer = io.BytesIO()
+            np.lib.format.write_array(buffer, np.asanyarray(array), allow_pickle=False)
+            file.writestr(zipfile.ZipInfo(f"{name}.npy", date_time=(1980, 1, 1, 0, 0, 0)), buffer.getvalue())
+
+
+class IndexedTFRecordWriter(object):
+
+    # writes a TFRecord file together with an index sidecar `{filename}.index.npz`
+    # which holds record counts, byte offsets and per-record pitch / source
+    # so that readers don't have to scan the whole file
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self.writer = tf.io.TFRecordWriter(filename)
+        self.offset = 0
+        self.offsets = []
+        self.lengths = []
+        self.pitches = []
+        self.sources = []
+
+    def write(self, record, pitch, source):
+
+        self.writer.write(record)
+        self.offsets.append(self.offset)
+        self.lengths.append(len(record))
+        self.pitches.append(pitch)
+        self.sources.append(source)
+        # uint64 length + uint32 masked crc of length + data + uint32 masked crc of data
+        self.offset += len(record) + 16
+
+    def close(self):
+
+        self.writer.close()
+        save_npz(
+            f"{self.filename}.index.npz",
+            offsets=np.array(self.offsets, dtype=np.int64),
+            lengths=np.array(self.lengths, dtype=np.int64),
+            pitches=np.array(self.pitches, dtype=np.int64),
+            sources=np.array(self.sources, dtype=np.int64)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class IndexedPCMWriter(object):
 
-    nsynth_all_examples = {}
-    for filename in pathlib.Path(".").glob("nsynth*/*.json"):
+    # writes a packed int16 shard (one contiguous `.npy` array of fixed 64000-sample notes) as notes arrive
+    # plus the same index sidecar as tfrecords where offsets are row indices
+    # the `.npy` header is rewritten with the final number of rows on close
+    # (numpy pads it to the same length for any number of rows, which is checked on close)
+
+    def __init__(self, filename, num_samples=64000):
+
+        self.filename = filename
+        self.num_samples = num_samples
+        self.file = open(filename, "wb")
+        self.offsets = []
+        self.lengths = []
+        self.pitches = []
+        self.sources = []
+        self.write_header()
+        self.header_size = self.file.tell()
+
+    def write_header(self):
+
+        np.lib.format.write_array_header_1_0(self.file, dict(
+            descr="<i2",
+            fortran_order=False,
+            shape=(len(self.offsets), self.num_samples)
+        ))
+
+    def write(self, record, pitch, source):
+
+        # `record` is the little-endian int16 bytes of one note
+        self.file.write(record)
+        self.offsets.append(len(self.offsets))
+        self.lengths.append(self.num_samples)
+        self.pitches.append(pitch)
+        self.sources.append(source)
+
+    def close(self):
+
+        self.file.seek(0)
+        self.write_header()
+        header_size = self.file.tell()
+        self.file.close()
+        if header_size != self.header_size:
+            raise ValueError(f"{self.filename}: the .npy header grew from {self.header_size} to {header_size} bytes")
+        save_npz(
+            f"{self.filename}.index.npz",
+            offsets=np.array(self.offsets, dtype=np.int64),
+            lengths=np.array(self.lengths, dtype=np.int64),
+            pitches=np.array(self.pitches, dtype=np.int64),
+            sources=np.array(self.sources, dtype=np.int64)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_examples(nsynth_dir, predicate):
+
+    # load one json at a time and keep just the fields we need
+    # instead of merging every `nsynth*/*.json` into one big dict
+    for filename in sorted(pathlib.Path(nsynth_dir).glob("nsynth*/*.json")):
         with open(filename) as file:
-            nsynth_examples = json.load(file)
-            for key, value in nsynth_examples.items():
-                value.update(dict(path=str(filename.parent/"audio"/f"{key}.wav")))
-            nsynth_all_examples.update(nsynth_examples)
-
-    nsynth_all_examples = list(nsynth_all_examples.items())
-    random.shuffle(nsynth_all_examples)
-
-    nsynth_train_examples = nsynth_all_examples[:int(len(nsynth_all_examples) * 0.8)]
-    nsynth_test_examples = nsynth_all_examples[int(len(nsynth_all_examples) * 0.8):]
-
-    for nsynth_name, nsynth_examples in [("nsynth_train", nsynth_train_examples), ("nsynth_test", nsynth_test_examples)]:
-        with tf.io.TFRecordWriter(f"{nsynth_name}.tfrecord") as writer:
-            for key, value in nsynth_examples:
-                writer.write(
-                    record=tf.train.Example(
-                        features=tf.train.Features(
-                            feature=dict(
-                                path=tf.train.Feature(
-                                    bytes_list=tf.train.BytesList(
-                                        value=[value["path"].encode()]
-                                    )
-                                ),
-                                pitch=tf.train.Feature(
-                                    int64_list=tf.train.Int64List(
-                                        value=[value["pitch"]]
-                                    )
-                                ),
-                                source=tf.train.Feature(
-                                    int64_list=tf.train.Int64List(
-                                        value=[value["instrument_source"]]
-                                    )
-                                )
-                            )
-                        )
-                    ).SerializeToString()
+            for key, value in json.load(file).items():
+                if predicate(value):
+                    yield Struct(
+                        key=key,
+                        path=str(filename.parent/"audio"/f"{key}.wav"),
+                        pitch=value["pitch"],
+                        source=value["instrument_source"],
+                        family=value["instrument_family"],
+                        velocity=value["velocity"]
+                    )
+
+
+def split_hash(key, seed):
+
+    # uniform in [0, 1), independent of file order and process
+    digest = hashlib.sha256(f"{seed}/{key}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") / (1 << 64)
+
+
+def make_record(path, pitch, source):
+
+    # the order of the feature map is fixed so that the records are byte-identical across processes and runs
+
+    return tf.train.Example(
+        features=tf.train.Features(
+            feature=dict(
+                path=tf.train.Feature(
+                    bytes_list=tf.train.BytesList(
+                        value=[path.encode()]
+                    )
+                ),
+                pitch=tf.train.Feature(
+                    int64_list=tf.train.Int64List(
+                        value=[pitch]
+                    )
+                ),
+                source=tf.train.Feature(
+                    int64_list=tf.train.Int64List(
+                        value=[source]
+                    )
                 )
+            )
+        )
+    ).SerializeToString(deterministic=True)
+
+
+def read_pcm(path, num_samples=64000):
+
+    with wave.open(path, "rb") as file:
+        pcm = np.frombuffer(file.readframes(num_samples), dtype="<i2")
+
+    return np.pad(pcm, [0, num_samples - len(pcm)], mode="constant")
+
+
+def make_pcm_record(path, pitch, source):
+
+    return read_pcm(path).tobytes()
+
+
+def write_shard(params):
+
+    # each pool task writes a whole shard from its (already sorted) examples
+    # and returns the record offsets and lengths for the columnar index
+    filename, writer_class, record_maker, examples = params
+
+    with writer_class(filename) as writer:
+        for path, pitch, source in examples:
+            writer.write(record_maker(path, pitch, source), pitch, source)
+
+    return filename, writer.offsets, writer.lengths
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nsynth_dir", type=str, default=".")
+    parser.add_argument("--output_dir", type=str, default=".")
+    parser.add_argument("--num_shards", type=int, default=8)
+    parser.add_argument("--format", type=str, default="tfrecord", choices=["tfrecord", "pcm"])
+    parser.add_argument("--valid_fraction", type=float, default=0.1)
+    parser.add_argument("--test_fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--min_pitch", type=int, default=None)
+    parser.add_argument("--max_pitch", type=int, default=None)
+    parser.add_argument("--sources", type=int, nargs="+", default=None)
+    args = parser.parse_args()
+
+    # write pre-filtered tfrecords (e.g. --min_pitch 24 --max_pitch 84 --sources 0)
+    # so that the I/O volume matches what training actually consumes
+    def predicate(value):
+        return all([
+            args.min_pitch is None or value["pitch"] >= args.min_pitch,
+            args.max_pitch is None or value["pitch"] <= args.max_pitch,
+            args.sources is None or value["instrument_source"] in args.sources
+        ])
+
+    # Following the paper, create a new train/valid/test 80/10/10 split from shuffled data,
+    # as the original split was divided along instrument type.
+    # The split, the shard and the order within each shard are derived from a seeded hash of the key,
+    # so reruns with the same seed produce byte-identical shards.
+    boundaries = dict(
+        train=(0.0, 1.0 - args.valid_fraction - args.test_fraction),
+        valid=(1.0 - args.valid_fraction - args.test_fraction, 1.0 - args.test_fraction),
+        test=(1.0 - args.test_fraction, 1.0)
+    )
+
+    def assign(example):
+        example_hash = split_hash(example.key, args.seed)
+        for split, (lower, upper) in boundaries.items():
+            if lower <= example_hash < upper:
+                return split, example_hash, min(int((example_hash - lower) / (upper - lower) * args.num_shards), args.num_shards - 1)
+
+    writer_class, record_maker, extension = dict(
+        tfrecord=(IndexedTFRecordWriter, make_record, "tfrecord"),
+        pcm=(IndexedPCMWriter, make_pcm_record, "npy")
+    )[args.format]
+
+    filenames = {
+        split: [
+            str(pathlib.Path(args.output_dir)/f"nsynth_{split}-{shard:05d}-of-{args.num_shards:05d}.{extension}")
+            for shard in range(args.num_shards)
+        ] for split in boundaries
+    }
+
+    # just the metadata of the examples is held in memory, partitioned into shards and sorted by (hash, key)
+    shard_examples = {split: [[] for _ in range(args.num_shards)] for split in boundaries}
+    for example in load_examples(args.nsynth_dir, predicate):
+        split, example_hash, shard = assign(example)
+        example.hash = example_hash
+        shard_examples[split][shard].append(example)
+    for split in boundaries:
+        for examples in shard_examples[split]:
+            examples.sort(key=lambda example: (example.hash, example.key))
+
+    # each pool task writes a whole shard (reading its notes for the pcm format)
+    with multiprocessing.Pool(args.processes) as pool:
+        locations = {}
+        for filename, offsets, lengths in pool.imap_unordered(write_shard, [
+            (filename, writer_class, record_maker, [(example.path, example.pitch, example.source) for example in examples])
+            for split in boundaries for filename, examples in zip(filenames[split], shard_examples[split])
+        ]):
+            print(f"{filename}: {len(offsets)} examples")
+            locations[filename] = (offsets, lengths)
+
+    # compact columnar index of each split so that subsets (pitch ranges, sources, families, velocities)
+    # can be resolved to shard offsets up front by `nsynth_input_fn(index_filename=...)`
+    columns = {
+        split: dict(shards=[], offsets=[], lengths=[], pitches=[], sources=[], families=[], velocities=[])
+        for split in boundaries
+    }
+    for split in boundaries:
+        for shard, (filename, examples) in enumerate(zip(filenames[split], shard_examples[split])):
+            offsets, lengths = locations[filename]
+            columns[split]["shards"].extend([shard] * len(examples))
+            columns[split]["offsets"].extend(offsets)
+            columns[split]["lengths"].extend(lengths)
+            columns[split]["pitches"].extend([example.pitch for example in examples])
+            columns[split]["sources"].extend([example.source for example in examples])
+            columns[split]["families"].extend([example.family for example in examples])
+            columns[split]["velocities"].extend([example.velocity for example in examples])
+        save_npz(
+            str(pathlib.Path(args.output_dir)/f"nsynth_{split}.index.npz"),
+            filenames=np.array(filenames[split]),
+            **{name: np.array(column, dtype=np.int64) for name, column in columns[split].items()}
+        )
@@ -1,8 +1,97 @@
 import tensorflow as tf
 import numpy as np
+import time
 import metrics
 import spectral_ops
 from termcolor import cprint
+from ops import upscale2d, downscale2d
+from utils import Struct
+
+
+def accumulate_gradients(optimizer, grads_and_vars, accumulation_steps, global_step=None):
+
+    # gradient accumulation for large effective batches within fixed memory
+    # returns an op that adds the current micro-batch gradients to local accumulators
+    # and a train op that applies the mean of the accumulated and current gradients
+    # (the gradient of the mean loss over all `accumulation_steps` micro-batches) and resets the accumulators
+    # run the former `accumulation_steps - 1` times before each run of the latter
+
+    if accumulation_steps == 1:
+        return None, optimizer.apply_gradients(grads_and_vars, global_step=global_step)
+
+    grads_and_vars = [(gradient, variable) for gradient, variable in grads_and_vars if gradient is not None]
+
+    accumulators = [
+        tf.Variable(
+            initial_value=tf.zeros(variable.shape, dtype=variable.dtype.base_dtype),
+            trainable=False,
+            collections=[tf.GraphKeys.LOCAL_VARIABLES],
+            name=f"{variable.op.name}/accumulator"
+        ) for _, variable in grads_and_vars
+    ]
+
+    accumulate_op = tf.group(*[
+        tf.assign_add(accumulator, gradient)
+        for accumulator, (gradient, _) in zip(accumulators, grads_and_vars)
+    ])
+
+    apply_op = optimizer.apply_gradients(
+        grads_and_vars=[
+            (tf.assign_add(accumulator, gradient) / accumulation_steps, variable)
+            for accumulator, (gradient, variable) in zip(accumulators, grads_and_vars)
+        ],
+        global_step=global_step
+    )
+    with tf.control_dependencies([apply_op]):
+        train_op = tf.group(*[
+            tf.assign(accumulator, tf.zeros_like(accumulator))
+            for accumulator in accumulators
+        ])
+
+    return accumulate_op, train_op
+
+
+class CombinedOptimizer(tf.train.Optimizer):
+
+    # applies the gradients of each group of variables with the optimizer of that group in a single update
+    # and increments `global_step` once, so that one `SyncReplicasOptimizer` can aggregate several networks
+    # (every `SyncReplicasOptimizer` creates its token queue with the same shared name "sync_token_q",
+    # so two of them in one graph share one queue and mix their tokens and steps)
+
+    def __init__(self, optimizers_and_variables, name="CombinedOptimizer"):
+
+        super().__init__(use_locking=False, name=name)
+        self.optimizers_and_variables = optimizers_and_variables
+
+    def apply_gradients(self, grads_and_vars, global_step=None, name=None):
+
+        grads_and_vars = list(grads_and_vars)
+        update_ops = []
+        for optimizer, variables in self.optimizers_and_variables:
+            names = {variable.op.name for variable in variables}
+            update_ops.append(optimizer.apply_gradients([
+                (gradient, variable) for gradient, variable in grads_and_vars
+                if variable.op.name in names
+            ]))
+        if global_step is None:
+            return tf.group(*update_ops, name=name)
+        with tf.control_dependencies(update_ops), tf.colocate_with(global_step):
+            return tf.assign_add(global_step, 1, name=name).op
+
+    def get_slot(self, var, name):
+
+        for optimizer, _ in self.optimizers_and_variables:
+            slot = optimizer.get_slot(var, name)
+            if slot is not None:
+                return slot
+
+    def get_slot_names(self):
+
+        return sorted(set(name for optimizer, _ in self.optimizers_and_variables for name in optimizer.get_slot_names()))
+
+    def variables(self):
+
+        return [variable for optimizer, _ in self.optimizers_and_variables for variable in optimizer.variables()]
 
 
 class GANSynth(object):
@@ -19,47 +108,82 @@ class GANSynth(object):
         # (https://arxiv.org/pdf/1801.04406.pdf)
         # -----------------------------------------------------------------------------------------
 
-        real_waveforms, labels = real_input_fn()
-
-        real_magnitude_spectrograms, real_instantaneous_frequencies = spectral_ops.convert_to_spectrogram(real_waveforms, **spectral_params)
-        real_images = tf.stack([real_magnitude_spectrograms, real_instantaneous_frequencies], axis=1)
+        real_inputs, real_labels = real_input_fn()
+
+        # the input pipeline yields either waveforms or precomputed spectrogram images
+        # (possibly already at the resolution of the current growing stage)
+        if real_inputs.shape.ndims == 4:
+            real_images = real_inputs
+            real_waveforms = spectral_ops.convert_to_waveform(*tf.unstack(upscale2d(
+                inputs=real_images,
+                factors=np.asanyarray(spectral_params.spectrogram_shape) // np.asanyarray(real_images.shape[2:].as_list())
+            ), axis=1), **spectral_params)
+        else:
+            real_waveforms = real_inputs
+            real_images = tf.stack(spectral_ops.convert_to_spectrogram(real_waveforms, **spectral_params), axis=1)
+
+        # generator labels are sampled independently of the real batch
+        # so that the generator step doesn't pull (and decode) another real batch
+        # (without fake labels, e.g. in evaluation, the fake images are generated with the real labels)
+        fake_latents, fake_labels = fake_input_fn()
+        if fake_labels is None:
+            fake_labels = real_labels
+        fake_images = generator(fake_latents, fake_labels)
+
+        # the classifier in evaluation takes the real images before they are downscaled
+        # (the input pipeline yields them at the full resolution unless it's asked for the resolution of the stage)
+        classifier_real_images = upscale2d(
+            inputs=real_images,
+            factors=np.asanyarray(spectral_params.spectrogram_shape) // np.asanyarray(real_images.shape[2:].as_list())
+        )
 
-        fake_latents = fake_input_fn()
-        fake_images = generator(fake_latents, labels)
+        # with resolution-native progressive growing the generator outputs images at the resolution of the current stage
+        # the real images are downscaled once to that resolution (unless the input pipeline already did)
+        # and the fake waveforms are converted from the fake images upscaled to the full resolution
+        real_images = downscale2d(
+            inputs=real_images,
+            factors=np.asanyarray(real_images.shape[2:].as_list()) // np.asanyarray(fake_images.shape[2:].as_list())
+        )
+        factors = np.asanyarray(spectral_params.spectrogram_shape) // np.asanyarray(fake_images.shape[2:].as_list())
+        fake_waveforms = spectral_ops.convert_to_waveform(*tf.unstack(upscale2d(fake_images, factors), axis=1), **spectral_params)
 
+        real_magnitude_spectrograms, real_instantaneous_frequencies = tf.unstack(real_images, axis=1)
         fake_magnitude_spectrograms, fake_instantaneous_frequencies = tf.unstack(fake_images, axis=1)
-        fake_waveforms = spectral_ops.convert_to_waveform(fake_magnitude_spectrograms, fake_instantaneous_frequencies, **spectral_params)
 
-        real_logits = discriminator(real_images, labels)
-        fake_logits = discriminator(fake_images, labels)
+        real_logits = discriminator(real_images, real_labels)
+        fake_logits = discriminator(fake_images, fake_labels)
 
         # non-saturating loss
         discriminator_losses = tf.nn.softplus(-real_logits)
         discriminator_losses += tf.nn.softplus(fake_logits)
+        discriminator_regularizers = {}
         # zero-centerd gradient penalty on data distribution
         if hyper_params.real_gradient_penalty_weight:
             real_gradients = tf.gradients(real_logits, [real_images])[0]
             real_gradient_penalties = tf.reduce_sum(tf.square(real_gradients), axis=[1, 2, 3])
-            discriminator_losses += real_gradient_penalties * hyper_params.real_gradient_penalty_weight
+            discriminator_regularizers["real_gradient_penalty"] = real_gradient_penalties * hyper_params.real_gradient_penalty_weight
         # zero-centerd gradient penalty on generator distribution
         if hyper_params.fake_gradient_penalty_weight:
             fake_gradients = tf.gradients(fake_logits, [fake_images])[0]
             fake_gradient_penalties = tf.reduce_sum(tf.square(fake_gradients), axis=[1, 2, 3])
-            discriminator_losses += fake_gradient_penalties * hyper_params.fake_gradient_penalty_weight
-
-        fake_latents = fake_input_fn()
-        fake_images = generator(fake_latents, labels)
-
-        fake_logits = discriminator(fake_images, labels)
+            discriminator_regularizers["fake_gradient_penalty"] = fake_gradient_penalties * hyper_params.fake_gradient_penalty_weight
 
+        # the generator loss shares the generator and discriminator outputs with the discriminator loss
+        # (each `session.run` of the generator step samples new latents anyway)
         # non-saturating loss
         generator_losses = tf.nn.softplus(-fake_logits)
+        generator_regularizers = {}
         # gradient-based mode-seeking loss
         if hyper_params.mode_seeking_loss_weight:
             latent_gradients = tf.gradients(fake_images, [fake_latents])[0]
             mode_seeking_losses = 1.0 / (tf.reduce_sum(tf.square(latent_gradients), axis=[1]) + 1.0e-6)
-            generator_losses += mode_seeking_losses * hyper_params.mode_seeking_loss_weight
+            generator_regularizers["mode_seeking_loss"] = mode_seeking_losses * hyper_params.mode_seeking_loss_weight
+
+        def regularized_loss(losses, regularizers, scale):
+            return tf.reduce_mean(tf.add_n([losses] + [regularizer * scale for regularizer in regularizers.values()]))
 
+        # the summary and logging hooks fetch the losses without the regularizers
+        # since fetching those on an unregularized step would run their extra backward passes anyway
         generator_loss = tf.reduce_mean(generator_losses)
         discriminator_loss = tf.reduce_mean(discriminator_losses)
 
@@ -77,15 +201,124 @@ class GANSynth(object):
         generator_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="generator")
         discriminator_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="discriminator")
 
-        generator_train_op = generator_optimizer.minimize(
-            loss=generator_loss,
-            var_list=generator_variables,
-            global_step=tf.train.get_or_create_global_step()
-        )
-        discriminator_train_op = discriminator_optimizer.minimize(
-            loss=discriminator_loss,
-            var_list=discriminator_variables
+        # synchronous data-parallel training across `num_workers` replicas (between-graph replication)
+        # each update aggregates the gradients of `num_workers * accumulation_steps` micro-batches
+        # which replaces the local gradient accumulation
+        # a single `SyncReplicasOptimizer` aggregates the simultaneous generator and discriminator update
+        if hyper_params.num_workers > 1:
+            if hyper_params.regularization_interval > 1:
+                raise ValueError("lazy regularization is not supported with multiple workers")
+            if not hyper_params.fused_train_step:
+                raise ValueError("multiple workers require the fused train step")
+            sync_optimizer = tf.train.SyncReplicasOptimizer(
+                opt=CombinedOptimizer([
+                    (generator_optimizer, generator_variables),
+                    (discriminator_optimizer, discriminator_variables)
+                ]),
+                replicas_to_aggregate=hyper_params.num_workers * hyper_params.accumulation_steps,
+                total_num_replicas=hyper_params.num_workers
+            )
+            accumulation_steps = 1
+        else:
+            sync_optimizer = None
+            accumulation_steps = hyper_params.accumulation_steps
+
+        def train_ops(generator_loss, discriminator_loss):
+
+            generator_grads_and_vars = generator_optimizer.compute_gradients(
+                loss=generator_loss,
+                var_list=generator_variables
+            )
+            discriminator_grads_and_vars = discriminator_optimizer.compute_gradients(
+                loss=discriminator_loss,
+                var_list=discriminator_variables
+            )
+
+            if hyper_params.fused_train_step:
+                # simultaneous discriminator and generator updates from one forward / backward pass in a single `session.run`
+                # every gradient is computed before any variable is updated
+                # since the updates are in-place and the other network's gradients read the same variables
+                with tf.control_dependencies([
+                    gradient for gradient, _ in generator_grads_and_vars + discriminator_grads_and_vars
+                    if gradient is not None
+                ]):
+                    generator_grads_and_vars = [
+                        (gradient if gradient is None else tf.identity(gradient), variable)
+                        for gradient, variable in generator_grads_and_vars
+                    ]
+                    discriminator_grads_and_vars = [
+                        (gradient if gradient is None else tf.identity(gradient), variable)
+                        for gradient, variable in discriminator_grads_and_vars
+                    ]
+
+            if sync_optimizer is not None:
+                return Struct(
+                    generator_train_op=None,
+                    discriminator_train_op=None,
+                    train_op=sync_optimizer.apply_gradients(
+                        grads_and_vars=generator_grads_and_vars + discriminator_grads_and_vars,
+                        global_step=tf.train.get_or_create_global_step()
+                    ),
+                    generator_accumulate_op=None,
+                    discriminator_accumulate_op=None,
+                    accumulate_op=None
+                )
+
+            # with `accumulation_steps` > 1 each update averages the gradients over that many micro-batches
+            # the gradient penalty and the mode-seeking loss are per-example terms so their means accumulate exactly
+            # and `batch_stddev` only needs each micro-batch to be a multiple of its groups
+            generator_accumulate_op, generator_train_op = accumulate_gradients(
+                optimizer=generator_optimizer,
+                grads_and_vars=generator_grads_and_vars,
+                accumulation_steps=accumulation_steps,
+                global_step=tf.train.get_or_create_global_step()
+            )
+            discriminator_accumulate_op, discriminator_train_op = accumulate_gradients(
+                optimizer=discriminator_optimizer,
+                grads_and_vars=discriminator_grads_and_vars,
+                accumulation_steps=accumulation_steps,
+                global_step=None
+            )
+
+            if hyper_params.fused_train_step:
+                train_op = tf.group(discriminator_train_op, generator_train_op)
+                if accumulation_steps > 1:
+                    accumulate_op = tf.group(discriminator_accumulate_op, generator_accumulate_op)
+                else:
+                    accumulate_op = None
+            else:
+                # alternating updates where the generator step sees the updated discriminator
+                train_op = None
+                accumulate_op = None
+
+            return Struct(
+                generator_train_op=generator_train_op,
+                discriminator_train_op=discriminator_train_op,
+                train_op=train_op,
+                generator_accumulate_op=generator_accumulate_op,
+                discriminator_accumulate_op=discriminator_accumulate_op,
+                accumulate_op=accumulate_op
+            )
+
+        # -----------------------------------------------------------------------------------------
+        # Lazy Regularization
+        # [Analyzing and Improving the Image Quality of StyleGAN]
+        # (https://arxiv.org/pdf/1912.04958.pdf)
+        # the gradient penalties and the mode-seeking loss each need another backward pass
+        # so they are only applied every `regularization_interval` steps with their weights scaled up accordingly
+        # -----------------------------------------------------------------------------------------
+        regularization_interval = hyper_params.regularization_interval
+        regularized_train_ops = train_ops(
+            generator_loss=regularized_loss(generator_losses, generator_regularizers, regularization_interval),
+            discriminator_loss=regularized_loss(discriminator_losses, discriminator_regularizers, regularization_interval)
         )
+        if regularization_interval > 1:
+            unregularized_train_ops = train_ops(
+                generator_loss=tf.reduce_mean(generator_losses),
+                discriminator_loss=tf.reduce_mean(discriminator_losses)
+            )
+        else:
+            unregularized_train_ops = regularized_train_ops
 
         self.real_waveforms = real_waveforms
         self.fake_waveforms = fake_waveforms
@@ -95,24 +328,73 @@ class GANSynth(object):
         self.fake_instantaneous_frequencies = fake_instantaneous_frequencies
         self.real_images = real_images
         self.fake_images = fake_images
+        self.classifier_real_images = classifier_real_images
+        self.image_factors = factors
         self.generator_loss = generator_loss
         self.discriminator_loss = discriminator_loss
-        self.generator_train_op = generator_train_op
-        self.discriminator_train_op = discriminator_train_op
-
-    def train(self, model_dir, config, total_steps, save_checkpoint_steps, save_summary_steps, log_tensor_steps):
+        # the (weighted) regularizers are fetched along with the train ops of the regularized steps instead
+        self.generator_regularizers = {name: tf.reduce_mean(regularizer) for name, regularizer in generator_regularizers.items()}
+        self.discriminator_regularizers = {name: tf.reduce_mean(regularizer) for name, regularizer in discriminator_regularizers.items()}
+        self.regularized_train_ops = regularized_train_ops
+        self.unregularized_train_ops = unregularized_train_ops
+        self.regularization_interval = regularization_interval
+        self.accumulation_steps = accumulation_steps
+        self.sync_optimizers = [] if sync_optimizer is None else [sync_optimizer]
+
+    def train(self, model_dir, config, total_steps, save_checkpoint_steps, save_summary_steps, log_tensor_steps,
+              master="", is_chief=True, new_variable_scopes=None):
+
+        # with resolution-native progressive growing each stage builds its own graph
+        # whose new blocks (and their optimizer slots) don't exist in the checkpoint of the previous stage
+        # so at a stage transition (`new_variable_scopes`, the scopes of the blocks the new stage adds)
+        # the variables under those scopes are initialized and all the others are restored
+        # (the input pipeline of a new stage differs, e.g. in its batch size, so its iterator starts afresh)
+        # any other variable missing from the checkpoint or with a different shape is an error
+        checkpoint = tf.train.latest_checkpoint(model_dir)
+        init_fn = None
+        if is_chief and checkpoint:
+            checkpoint_shapes = dict(tf.train.list_variables(checkpoint))
+            for variable in tf.global_variables():
+                if variable.op.name in checkpoint_shapes and checkpoint_shapes[variable.op.name] != variable.shape.as_list():
+                    raise ValueError(
+                        f"{variable.op.name} has shape {variable.shape.as_list()} "
+                        f"but {checkpoint_shapes[variable.op.name]} in {checkpoint}"
+                    )
+            missing_variables = [
+                variable for variable in tf.global_variables()
+                if variable.op.name not in checkpoint_shapes
+            ]
+            if missing_variables:
+                unexpected_variables = [
+                    variable.op.name for variable in missing_variables
+                    if not set(new_variable_scopes or []) & set(variable.op.name.split("/"))
+                ]
+                if unexpected_variables:
+                    raise ValueError(f"{checkpoint} is missing {unexpected_variables}")
+                saver = tf.train.Saver(var_list=[
+                    variable for variable in tf.global_variables()
+                    if variable.op.name in checkpoint_shapes
+                ])
+                init_fn = lambda scaffold, session: saver.restore(session, checkpoint)
+
+        scaffold = tf.train.Scaffold(
+            init_op=tf.global_variables_initializer(),
+            init_fn=init_fn,
+            local_init_op=tf.group(
+                tf.local_variables_initializer(),
+                tf.tables_initializer()
+            )
+        )
 
-        with tf.train.SingularMonitoredSession(
-            scaffold=tf.train.Scaffold(
-                init_op=tf.global_variables_initializer(),
-                local_init_op=tf.group(
-                    tf.local_variables_initializer(),
-                    tf.tables_initializer()
-                )
-            ),
-            checkpoint_dir=model_dir,
-            config=config,
-            hooks=[
+        # only the chief initializes or restores variables and writes checkpoints and summaries
+        if is_chief:
+            session_creator = tf.train.ChiefSessionCreator(
+                scaffold=scaffold,
+                master=master,
+                config=config,
+                checkpoint_dir=None if init_fn else model_dir
+            )
+            chief_hooks = [
                 tf.train.CheckpointSaverHook(
                     checkpoint_dir=model_dir,
                     save_steps=save_checkpoint_steps,
@@ -164,39 +446,99 @@ class GANSynth(object):
                             discriminator_loss=self.discriminator_loss
                         ).items()
                     ]),
-                ),
-                tf.train.LoggingTensorHook(
-                    tensors=dict(
-                        global_step=tf.train.get_global_step(),
-                        generator_loss=self.generator_loss,
-                        discriminator_loss=self.discriminator_loss
-                    ),
-                    every_n_iter=log_tensor_steps,
-                ),
-                tf.train.StopAtStepHook(
-                    last_step=total_steps
                 )
             ]
+        else:
+            session_creator = tf.train.WorkerSessionCreator(
+                scaffold=scaffold,
+                master=master,
+                config=config
+            )
+            chief_hooks = []
+
+        hooks = [
+            tf.train.LoggingTensorHook(
+                tensors=dict(
+                    global_step=tf.train.get_global_step(),
+                    generator_loss=self.generator_loss,
+                    discriminator_loss=self.discriminator_loss
+                ),
+                every_n_iter=log_tensor_steps,
+            ),
+            tf.train.StopAtStepHook(
+                last_step=total_steps
+            )
+        ] + [
+            optimizer.make_session_run_hook(is_chief)
+            for optimizer in self.sync_optimizers
+        ]
+
+        with tf.train.MonitoredSession(
+            session_creator=session_creator,
+            hooks=chief_hooks + hooks
         ) as session:
 
+            def train_step(train_ops, regularized):
+                # returns the regularizers of the last micro-batch on regularized steps
+                # (each fetched in the run that computes them anyway)
+                generator_regularizers = self.generator_regularizers if regularized else {}
+                discriminator_regularizers = self.discriminator_regularizers if regularized else {}
+                if train_ops.train_op is not None:
+                    for _ in range(self.accumulation_steps - 1):
+                        session.run(train_ops.accumulate_op)
+                    _, regularizers = session.run([train_ops.train_op, {**discriminator_regularizers, **generator_regularizers}])
+                else:
+                    for _ in range(self.accumulation_steps - 1):
+                        session.run(train_ops.discriminator_accumulate_op)
+                    _, regularizers = session.run([train_ops.discriminator_train_op, discriminator_regularizers])
+                    for _ in range(self.accumulation_steps - 1):
+                        session.run(train_ops.generator_accumulate_op)
+                    _, generator_regularizers = session.run([train_ops.generator_train_op, generator_regularizers])
+                    regularizers.update(generator_regularizers)
+                return regularizers
+
+            # each step increments the global step once
+            # (with multiple workers it's just a local count for logging)
+            global_step = session.run(tf.train.get_global_step())
+            # steps and seconds of the regularized and the unregularized steps
+            elapsed = dict(regularized=[0, 0.0], unregularized=[0, 0.0])
+            # the regularizers of the latest regularized step
+            regularizers = {}
+
             while not session.should_stop():
                 try:
-                    session.run(self.discriminator_train_op)
-                    session.run(self.generator_train_op)
+                    regularized = global_step % self.regularization_interval == 0
+                    begin = time.perf_counter()
+                    regularizers.update(train_step(self.regularized_train_ops if regularized else self.unregularized_train_ops, regularized))
+                    elapsed["regularized" if regularized else "unregularized"][0] += 1
+                    elapsed["regularized" if regularized else "unregularized"][1] += time.perf_counter() - begin
+                    global_step += 1
                 except tf.errors.OutOfRangeError:
                     break
+                if global_step % log_tensor_steps == 0:
+                    tf.logging.info(", ".join([
+                        f"{name}_steps/sec: {steps / seconds:.3f}"
+                        for name, (steps, seconds) in elapsed.items() if steps
+                    ] + [
+                        f"{name}: {value:.4g}"
+                        for name, value in regularizers.items()
+                    ]))
+                    elapsed = dict(regularized=[0, 0.0], unregularized=[0, 0.0])
 
     def evaluate(self, model_dir, config, classifier, images, features, logits):
 
+        # the classifier takes full resolution images
+        # (the real images from before they are downscaled to the resolution of the current stage
+        # and the fake images upscaled from it with resolution-native progressive growing)
         real_features, real_logits = tf.import_graph_def(
             graph_def=classifier,
-            input_map={images: self.real_images},
+            input_map={images: self.classifier_real_images},
             return_elements=[features, logits]
         )
 
         fake_features, fake_logits = tf.import_graph_def(
             graph_def=classifier,
-            input_map={images: self.fake_images},
+            input_map={images: upscale2d(self.fake_images, self.image_factors)},
             return_elements=[features, logits]
         )
 
@@ -230,10 +572,17 @@ class PitchClassifier(object):
 
     def __init__(self, network, input_fn, spectral_params, hyper_params):
 
-        waveforms, labels = input_fn()
+        inputs, labels = input_fn()
 
-        magnitude_spectrograms, instantaneous_frequencies = spectral_ops.convert_to_spectrogram(waveforms, **spectral_params)
-        images = tf.stack([magnitude_spectrograms, instantaneous_frequencies], axis=1)
+        # the input pipeline yields either waveforms or precomputed spectrogram images
+        if inputs.shape.ndims == 4:
+            images = inputs
+            magnitude_spectrograms, instantaneous_frequencies = tf.unstack(images, axis=1)
+            waveforms = spectral_ops.convert_to_waveform(magnitude_spectrograms, instantaneous_frequencies, **spectral_params)
+        else:
+            waveforms = inputs
+            magnitude_spectrograms, instantaneous_frequencies = spectral_ops.convert_to_spectrogram(waveforms, **spectral_params)
+            images = tf.stack([magnitude_spectrograms, instantaneous_frequencies], axis=1)
 
         features, logits = network(images)
 
@@ -260,11 +609,36 @@ class PitchClassifier(object):
             momentum=hyper_params.momentum,
             use_nesterov=hyper_params.use_nesterov
         )
-        with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
-            train_op = optimizer.minimize(
-                loss=loss,
-                global_step=tf.train.get_or_create_global_step()
+        # synchronous data-parallel training across `num_workers` replicas (between-graph replication)
+        # each update aggregates the gradients of `num_workers * accumulation_steps` micro-batches
+        # which replaces the local gradient accumulation
+        if hyper_params.num_workers > 1:
+            optimizer = tf.train.SyncReplicasOptimizer(
+                opt=optimizer,
+                replicas_to_aggregate=hyper_params.num_workers * hyper_params.accumulation_steps,
+                total_num_replicas=hyper_params.num_workers
             )
+            accumulation_steps = 1
+        else:
+            accumulation_steps = hyper_params.accumulation_steps
+
+        # gate the gradients (rather than the train op) on the moving statistics updates
+        # so that variables created by the optimizers don't depend on them
+        grads_and_vars = optimizer.compute_gradients(loss)
+        with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+            grads_and_vars = [
+                (gradient if gradient is None else tf.identity(gradient), variable)
+                for gradient, variable in grads_and_vars
+            ]
+
+        # with `accumulation_steps` > 1 each update averages the gradients over that many micro-batches
+        # (batch normalization statistics are still per micro-batch)
+        accumulate_op, train_op = accumulate_gradients(
+            optimizer=optimizer,
+            grads_and_vars=grads_and_vars,
+            accumulation_steps=accumulation_steps,
+            global_step=tf.train.get_or_create_global_step()
+        )
 
         self.waveforms = waveforms
         self.magnitude_spectrograms = magnitude_spectrograms
@@ -273,25 +647,35 @@ class PitchClassifier(object):
         self.accuracy = accuracy
         self.train_op = train_op
         self.update_op = update_op
+        self.accumulate_op = accumulate_op
+        self.accumulation_steps = accumulation_steps
+        self.sync_optimizers = [optimizer] if isinstance(optimizer, tf.train.SyncReplicasOptimizer) else []
 
         images = tf.placeholder(tf.float32, shape=[None, *images.shape[1:]], name="images")
         features, logits = network(images)
         features = tf.identity(features, name="features")
         logits = tf.identity(logits, name="logits")
 
-    def train(self, model_dir, config, total_steps, save_checkpoint_steps, save_summary_steps, log_tensor_steps):
+    def train(self, model_dir, config, total_steps, save_checkpoint_steps, save_summary_steps, log_tensor_steps,
+              master="", is_chief=True):
 
-        with tf.train.SingularMonitoredSession(
-            scaffold=tf.train.Scaffold(
-                init_op=tf.global_variables_initializer(),
-                local_init_op=tf.group(
-                    tf.local_variables_initializer(),
-                    tf.tables_initializer()
-                )
-            ),
-            checkpoint_dir=model_dir,
-            config=config,
-            hooks=[
+        scaffold = tf.train.Scaffold(
+            init_op=tf.global_variables_initializer(),
+            local_init_op=tf.group(
+                tf.local_variables_initializer(),
+                tf.tables_initializer()
+            )
+        )
+
+        # only the chief initializes or restores variables and writes checkpoints and summaries
+        if is_chief:
+            session_creator = tf.train.ChiefSessionCreator(
+                scaffold=scaffold,
+                master=master,
+                config=config,
+                checkpoint_dir=model_dir
+            )
+            chief_hooks = [
                 tf.train.CheckpointSaverHook(
                     checkpoint_dir=model_dir,
                     save_steps=save_checkpoint_steps,
@@ -340,23 +724,42 @@ class PitchClassifier(object):
                             accuracy=self.accuracy
                         ).items()
                     ]),
-                ),
-                tf.train.LoggingTensorHook(
-                    tensors=dict(
-                        global_step=tf.train.get_global_step(),
-                        loss=self.loss,
-                        accuracy=self.accuracy
-                    ),
-                    every_n_iter=log_tensor_steps,
-                ),
-                tf.train.StopAtStepHook(
-                    last_step=total_steps
                 )
             ]
+        else:
+            session_creator = tf.train.WorkerSessionCreator(
+                scaffold=scaffold,
+                master=master,
+                config=config
+            )
+            chief_hooks = []
+
+        hooks = [
+            tf.train.LoggingTensorHook(
+                tensors=dict(
+                    global_step=tf.train.get_global_step(),
+                    loss=self.loss,
+                    accuracy=self.accuracy
+                ),
+                every_n_iter=log_tensor_steps,
+            ),
+            tf.train.StopAtStepHook(
+                last_step=total_steps
+            )
+        ] + [
+            optimizer.make_session_run_hook(is_chief)
+            for optimizer in self.sync_optimizers
+        ]
+
+        with tf.train.MonitoredSession(
+            session_creator=session_creator,
+            hooks=chief_hooks + hooks
         ) as session:
 
             while not session.should_stop():
                 try:
+                    for _ in range(self.accumulation_steps - 1):
+                        session.run([self.accumulate_op, self.update_op])
                     session.run([self.train_op, self.update_op])
                 except tf.errors.OutOfRangeError:
                     break
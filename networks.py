@@ -13,20 +13,34 @@ def lerp(a, b, t):
 
 class PGGAN(object):
 
-    def __init__(self, min_resolution, max_resolution, min_channels, max_channels, growing_level):
+    def __init__(self, min_resolution, max_resolution, min_channels, max_channels, growing_level, active_depth=None,
+                 data_format="NCHW"):
 
         self.min_resolution = np.asanyarray(min_resolution)
         self.max_resolution = np.asanyarray(max_resolution)
         self.min_channels = min_channels
         self.max_channels = max_channels
         self.growing_level = growing_level
+        # with `active_depth`, only the stage at that depth is built (resolution-native progressive growing)
+        # the generator outputs and the discriminator inputs images at `min_resolution << active_depth`
+        # otherwise every stage is built in `tf.cond`s at `max_resolution`
+        self.active_depth = active_depth
+        # the layout of the feature maps (NHWC runs faster on CPU)
+        # images are NCHW at the interface of either network and the weights are the same in either layout
+        self.data_format = data_format
 
         def log2(x): return 0 if (x == 1).all() else 1 + log2(x >> 1)
 
         self.min_depth = log2(self.min_resolution // self.min_resolution)
         self.max_depth = log2(self.max_resolution // self.min_resolution)
 
-        self.growing_depth = log(1 + ((1 << (self.max_depth + 1)) - 1) * self.growing_level, 2.0)
+        # without `growing_level`, the networks are built fully grown up to `active_depth` (`max_depth` by default)
+        # with no fade-in (e.g. for inference)
+        if self.growing_level is None:
+            self.active_depth = self.max_depth if active_depth is None else active_depth
+            self.growing_depth = None
+        else:
+            self.growing_depth = log(1 + ((1 << (self.max_depth + 1)) - 1) * self.growing_level, 2.0)
 
     def generator(self, latents, labels, name="generator", reuse=tf.AUTO_REUSE):
 
@@ -52,8 +66,10 @@ class PGGAN(object):
                             tensor=inputs,
                             shape=[-1, channels(depth), *resolution(depth)]
                         )
+                        if self.data_format == "NHWC":
+                            inputs = tf.transpose(inputs, [0, 2, 3, 1])
                         inputs = tf.nn.leaky_relu(inputs)
-                        inputs = pixel_normalization(inputs)
+                        inputs = pixel_normalization(inputs, data_format=self.data_format)
                     with tf.variable_scope("conv"):
                         inputs = conv2d(
                             inputs=inputs,
@@ -61,10 +77,11 @@ class PGGAN(object):
                             kernel_size=[3, 3],
                             use_bias=True,
                             variance_scale=2.0,
-                            scale_weight=True
+                            scale_weight=True,
+                            data_format=self.data_format
                         )
                         inputs = tf.nn.leaky_relu(inputs)
-                        inputs = pixel_normalization(inputs)
+                        inputs = pixel_normalization(inputs, data_format=self.data_format)
                     return inputs
                 else:
                     with tf.variable_scope("upscale_conv"):
@@ -75,10 +92,11 @@ class PGGAN(object):
                             strides=[2, 2],
                             use_bias=True,
                             variance_scale=2.0,
-                            scale_weight=True
+                            scale_weight=True,
+                            data_format=self.data_format
                         )
                         inputs = tf.nn.leaky_relu(inputs)
-                        inputs = pixel_normalization(inputs)
+                        inputs = pixel_normalization(inputs, data_format=self.data_format)
                     with tf.variable_scope("conv"):
                         inputs = conv2d(
                             inputs=inputs,
@@ -86,10 +104,11 @@ class PGGAN(object):
                             kernel_size=[3, 3],
                             use_bias=True,
                             variance_scale=2.0,
-                            scale_weight=True
+                            scale_weight=True,
+                            data_format=self.data_format
                         )
                         inputs = tf.nn.leaky_relu(inputs)
-                        inputs = pixel_normalization(inputs)
+                        inputs = pixel_normalization(inputs, data_format=self.data_format)
                     return inputs
 
         def color_block(inputs, depth, reuse=tf.AUTO_REUSE):
@@ -101,7 +120,8 @@ class PGGAN(object):
                         kernel_size=[1, 1],
                         use_bias=True,
                         variance_scale=1.0,
-                        scale_weight=True
+                        scale_weight=True,
+                        data_format=self.data_format
                     )
                     inputs = tf.nn.tanh(inputs)
                 return inputs
@@ -114,13 +134,15 @@ class PGGAN(object):
             def middle_resolution_images():
                 return upscale2d(
                     inputs=color_block(conv_block(feature_maps, depth), depth),
-                    factors=resolution(self.max_depth) // resolution(depth)
+                    factors=resolution(self.max_depth) // resolution(depth),
+                    data_format=self.data_format
                 )
 
             def low_resolution_images():
                 return upscale2d(
                     inputs=color_block(feature_maps, depth - 1),
-                    factors=resolution(self.max_depth) // resolution(depth - 1)
+                    factors=resolution(self.max_depth) // resolution(depth - 1),
+                    data_format=self.data_format
                 )
 
             if depth == self.min_depth:
@@ -158,7 +180,23 @@ class PGGAN(object):
                 variance_scale=1.0,
                 scale_weight=True
             )
-            return grow(tf.concat([latents, labels], axis=1), self.min_depth)
+            feature_maps = tf.concat([latents, labels], axis=1)
+            if self.active_depth is None:
+                images = grow(feature_maps, self.min_depth)
+            else:
+                for depth in range(self.min_depth, self.active_depth):
+                    feature_maps = conv_block(feature_maps, depth)
+                images = color_block(conv_block(feature_maps, self.active_depth), self.active_depth)
+                # fade in the new block from the previous stage
+                if self.active_depth > self.min_depth and self.growing_depth is not None:
+                    images = lerp(
+                        a=upscale2d(color_block(feature_maps, self.active_depth - 1), data_format=self.data_format),
+                        b=images,
+                        t=tf.clip_by_value(self.active_depth - self.growing_depth, 0.0, 1.0)
+                    )
+            if self.data_format == "NHWC":
+                images = tf.transpose(images, [0, 3, 1, 2])
+            return images
 
     def discriminator(self, images, labels, name="discriminator", reuse=tf.AUTO_REUSE):
 
@@ -171,7 +209,10 @@ class PGGAN(object):
         def conv_block(inputs, depth, reuse=tf.AUTO_REUSE):
             with tf.variable_scope("conv_block_{}x{}".format(*resolution(depth)), reuse=reuse):
                 if depth == self.min_depth:
-                    inputs = tf.concat([inputs, batch_stddev(inputs)], axis=1)
+                    inputs = tf.concat([
+                        inputs,
+                        batch_stddev(inputs, data_format=self.data_format)
+                    ], axis=1 if self.data_format == "NCHW" else 3)
                     with tf.variable_scope("conv"):
                         inputs = conv2d(
                             inputs=inputs,
@@ -179,10 +220,14 @@ class PGGAN(object):
                             kernel_size=[3, 3],
                             use_bias=True,
                             variance_scale=2.0,
-                            scale_weight=True
+                            scale_weight=True,
+                            data_format=self.data_format
                         )
                         inputs = tf.nn.leaky_relu(inputs)
                     with tf.variable_scope("dense"):
+                        # flatten in the NCHW order for the same dense weights in either layout
+                        if self.data_format == "NHWC":
+                            inputs = tf.transpose(inputs, [0, 3, 1, 2])
                         inputs = tf.layers.flatten(inputs)
                         inputs = dense(
                             inputs=inputs,
@@ -216,7 +261,8 @@ class PGGAN(object):
                             kernel_size=[3, 3],
                             use_bias=True,
                             variance_scale=2.0,
-                            scale_weight=True
+                            scale_weight=True,
+                            data_format=self.data_format
                         )
                         inputs = tf.nn.leaky_relu(inputs)
                     with tf.variable_scope("conv_downscale"):
@@ -227,7 +273,8 @@ class PGGAN(object):
                             strides=[2, 2],
                             use_bias=True,
                             variance_scale=2.0,
-                            scale_weight=True
+                            scale_weight=True,
+                            data_format=self.data_format
                         )
                         inputs = tf.nn.leaky_relu(inputs)
                     return inputs
@@ -241,7 +288,8 @@ class PGGAN(object):
                         kernel_size=[1, 1],
                         use_bias=True,
                         variance_scale=2.0,
-                        scale_weight=True
+                        scale_weight=True,
+                        data_format=self.data_format
                     )
                     inputs = tf.nn.leaky_relu(inputs)
                 return inputs
@@ -254,13 +302,15 @@ class PGGAN(object):
             def middle_resolution_feature_maps():
                 return conv_block(color_block(downscale2d(
                     inputs=images,
-                    factors=resolution(self.max_depth) // resolution(depth)
+                    factors=resolution(self.max_depth) // resolution(depth),
+                    data_format=self.data_format
                 ), depth), depth)
 
             def low_resolution_feature_maps():
                 return color_block(downscale2d(
                     inputs=images,
-                    factors=resolution(self.max_depth) // resolution(depth - 1)
+                    factors=resolution(self.max_depth) // resolution(depth - 1),
+                    data_format=self.data_format
                 ), depth - 1)
 
             if depth == self.min_depth:
@@ -292,18 +342,34 @@ class PGGAN(object):
             return feature_maps
 
         with tf.variable_scope(name, reuse=reuse):
-            return grow(images, self.min_depth)
+            if self.data_format == "NHWC":
+                images = tf.transpose(images, [0, 2, 3, 1])
+            if self.active_depth is None:
+                return grow(images, self.min_depth)
+            feature_maps = conv_block(color_block(images, self.active_depth), self.active_depth)
+            # fade in the new block from the previous stage
+            if self.active_depth > self.min_depth and self.growing_depth is not None:
+                feature_maps = lerp(
+                    a=color_block(downscale2d(images, data_format=self.data_format), self.active_depth - 1),
+                    b=feature_maps,
+                    t=tf.clip_by_value(self.active_depth - self.growing_depth, 0.0, 1.0)
+                )
+            for depth in reversed(range(self.min_depth, self.active_depth)):
+                feature_maps = conv_block(feature_maps, depth)
+            return feature_maps
 
 
 class ResNet(object):
 
-    def __init__(self, conv_param, pool_param, residual_params, groups, classes):
+    def __init__(self, conv_param, pool_param, residual_params, groups, classes, data_format="NCHW"):
 
         self.conv_param = conv_param
         self.pool_param = pool_param
         self.residual_params = residual_params
         self.groups = groups
         self.classes = classes
+        # the layout of the feature maps (the inputs are NCHW in either layout)
+        self.data_format = data_format
 
     def __call__(self, inputs, name="resnet", reuse=tf.AUTO_REUSE):
 
@@ -320,7 +386,8 @@ class ResNet(object):
             with tf.variable_scope("group_normalization_1st"):
                 inputs = group_normalization(
                     inputs=inputs,
-                    groups=groups
+                    groups=groups,
+                    data_format=self.data_format
                 )
 
             inputs = tf.nn.relu(inputs)
@@ -334,7 +401,8 @@ class ResNet(object):
                         strides=strides,
                         use_bias=False,
                         variance_scale=2.0,
-                        apply_weight_standardization=True
+                        apply_weight_standardization=True,
+                        data_format=self.data_format
                     )
 
             with tf.variable_scope("conv_1st"):
@@ -345,13 +413,15 @@ class ResNet(object):
                     strides=strides,
                     use_bias=True,
                     variance_scale=2.0,
-                    apply_weight_standardization=True
+                    apply_weight_standardization=True,
+                    data_format=self.data_format
                 )
 
             with tf.variable_scope("group_normalization_2nd"):
                 inputs = group_normalization(
                     inputs=inputs,
-                    groups=groups
+                    groups=groups,
+                    data_format=self.data_format
                 )
 
             inputs = tf.nn.relu(inputs)
@@ -364,7 +434,8 @@ class ResNet(object):
                     strides=[1, 1],
                     use_bias=True,
                     variance_scale=2.0,
-                    apply_weight_standardization=True
+                    apply_weight_standardization=True,
+                    data_format=self.data_format
                 )
 
             inputs += shortcut
@@ -373,6 +444,9 @@ class ResNet(object):
 
         with tf.variable_scope(name, reuse=reuse):
 
+            if self.data_format == "NHWC":
+                inputs = tf.transpose(inputs, [0, 2, 3, 1])
+
             if self.conv_param:
                 with tf.variable_scope("conv"):
                     inputs = conv2d(
@@ -382,14 +456,16 @@ class ResNet(object):
                         strides=self.conv_param.strides,
                         use_bias=True,
                         variance_scale=2.0,
-                        apply_weight_standardization=True
+                        apply_weight_standardization=True,
+                        data_format=self.data_format
                     )
 
             if self.pool_param:
                 inputs = max_pooling2d(
                     inputs=inputs,
                     kernel_size=self.pool_param.kernel_size,
-                    strides=self.pool_param.strides
+                    strides=self.pool_param.strides,
+                    data_format=self.data_format
                 )
 
             for i, residual_param in enumerate(self.residual_params):
@@ -417,12 +493,13 @@ class ResNet(object):
             with tf.variable_scope("group_normalization"):
                 inputs = group_normalization(
                     inputs=inputs,
-                    groups=self.groups
+                    groups=self.groups,
+                    data_format=self.data_format
                 )
 
             inputs = tf.nn.relu(inputs)
 
-            features = tf.reduce_mean(inputs, axis=[2, 3])
+            features = tf.reduce_mean(inputs, axis=[2, 3] if self.data_format == "NCHW" else [1, 2])
 
             with tf.variable_scope("logits"):
                 logits = dense(
@@ -0,0 +1,304 @@
+import numpy as np
+import multiprocessing
+import functools
+import tempfile
+import zipfile
+import os
+from utils import Struct
+
+# NumPy / SciPy implementation of `spectral_ops` for offline tooling (feature caching, dataset stats, audio export, metrics)
+# it doesn't import TensorFlow, so it's cheap to use from worker processes
+# SciPy is imported only by the STFTs, so that `spectral_ops` can share the constants below without it
+
+
+def diff(inputs, axis=-1):
+    return np.diff(inputs, axis=axis)
+
+
+def unwrap(phases, axis=-1):
+    # same as `spectral_ops.unwrap` (`np.unwrap` differs at exactly +-pi)
+    diffs = diff(phases, axis=axis)
+    mods = np.mod(diffs + np.pi, np.pi * 2.0) - np.pi
+    indices = np.logical_and(np.equal(mods, -np.pi), np.greater(diffs, 0.0))
+    mods = np.where(indices, np.pi, mods)
+    corrects = mods - diffs
+    cumsums = np.cumsum(corrects, axis=axis)
+    cumsums = np.concatenate([np.zeros_like(np.take(cumsums, [0], axis=axis)), cumsums], axis=axis)
+    unwrapped = phases + cumsums
+    return unwrapped
+
+
+def instantaneous_frequency(phases, axis=-2):
+    unwrapped = unwrap(phases, axis=axis)
+    diffs = diff(unwrapped, axis=axis)
+    initials = np.take(unwrapped, [0], axis=axis)
+    diffs = np.concatenate([initials, diffs], axis=axis) / np.pi
+    return diffs
+
+
+def hertz_to_mel(frequencies_hertz):
+    return 1127.0 * np.log(1.0 + frequencies_hertz / 700.0)
+
+
+def linear_to_mel_weight_matrix(num_mel_bins, num_spectrogram_bins, sample_rate, lower_edge_hertz, upper_edge_hertz):
+    # NumPy port of `tf.signal.linear_to_mel_weight_matrix`
+    # HTK excludes the spectrogram DC bin
+    bands_to_zero = 1
+    linear_frequencies = np.linspace(0.0, sample_rate / 2.0, num_spectrogram_bins)[bands_to_zero:]
+    spectrogram_bins_mel = hertz_to_mel(linear_frequencies)[:, np.newaxis]
+    band_edges_mel = np.linspace(hertz_to_mel(lower_edge_hertz), hertz_to_mel(upper_edge_hertz), num_mel_bins + 2)
+    lower_edge_mel = band_edges_mel[np.newaxis, :-2]
+    center_mel = band_edges_mel[np.newaxis, 1:-1]
+    upper_edge_mel = band_edges_mel[np.newaxis, 2:]
+    lower_slopes = (spectrogram_bins_mel - lower_edge_mel) / (center_mel - lower_edge_mel)
+    upper_slopes = (upper_edge_mel - spectrogram_bins_mel) / (upper_edge_mel - center_mel)
+    mel_weight_matrix = np.maximum(0.0, np.minimum(lower_slopes, upper_slopes))
+    return np.pad(mel_weight_matrix, [[bands_to_zero, 0], [0, 0]], mode="constant")
+
+
+# bump whenever the port (or the pinv cutoff) changes so that stale caches aren't loaded
+MEL_WEIGHT_MATRICES_VERSION = 1
+
+
+def mel_weight_matrices(sample_rate, num_freq_bins,
+                        cache_dir=os.path.join(os.path.expanduser("~"), ".cache", "gan_synth")):
+
+    # the mel matrix and its pseudo-inverse, cached on disk across runs
+    # an unreadable cache (e.g. truncated by a killed process) is recomputed and overwritten
+    # and an unwritable cache directory (e.g. a read-only home on cluster nodes) just isn't cached to
+    cache_filename = os.path.join(
+        cache_dir,
+        f"mel_weight_matrices_v{MEL_WEIGHT_MATRICES_VERSION}_{sample_rate}_{num_freq_bins}.npz"
+    )
+    try:
+        with np.load(cache_filename) as arrays:
+            return arrays["linear_to_mel_weight_matrix"], arrays["mel_to_linear_weight_matrix"]
+    except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+        pass
+
+    linear_to_mel_matrix = linear_to_mel_weight_matrix(
+        num_mel_bins=num_freq_bins,
+        num_spectrogram_bins=num_freq_bins,
+        sample_rate=sample_rate,
+        lower_edge_hertz=0.0,
+        upper_edge_hertz=sample_rate / 2.0
+    ).astype(np.float32)
+    # same cutoff as `tfp.math.pinv`
+    mel_to_linear_matrix = np.linalg.pinv(
+        linear_to_mel_matrix.astype(np.float64),
+        rcond=10.0 * max(linear_to_mel_matrix.shape) * np.finfo(np.float32).eps
+    ).astype(np.float32)
+    # write to a temporary file in the same directory and rename it atomically
+    # so that concurrent processes never load a partially written cache
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".npz", delete=False) as file:
+            try:
+                np.savez(
+                    file,
+                    linear_to_mel_weight_matrix=linear_to_mel_matrix,
+                    mel_to_linear_weight_matrix=mel_to_linear_matrix
+                )
+                file.close()
+                os.replace(file.name, cache_filename)
+            except BaseException:
+                os.remove(file.name)
+                raise
+    except OSError:
+        pass
+
+    return linear_to_mel_matrix, mel_to_linear_matrix
+
+
+def hann_window(frame_length):
+    # periodic Hann window as `tf.signal.hann_window(periodic=True)`
+    return 0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(frame_length) / frame_length)
+
+
+def inverse_hann_window(frame_length, frame_step):
+    # NumPy port of `tf.signal.inverse_stft_window_fn`
+    forward_window = hann_window(frame_length)
+    denominator = np.square(forward_window)
+    overlaps = -(-frame_length // frame_step)
+    denominator = np.pad(denominator, [0, overlaps * frame_step - frame_length], mode="constant")
+    denominator = np.reshape(denominator, [overlaps, frame_step])
+    denominator = np.sum(denominator, axis=0, keepdims=True)
+    denominator = np.tile(denominator, [overlaps, 1])
+    denominator = np.reshape(denominator, [overlaps * frame_step])
+    return forward_window / denominator[:frame_length]
+
+
+def stft(signals, frame_length, frame_step, window):
+    # same as `tf.signal.stft(pad_end=False)` with `fft_length=frame_length`
+    # `scipy.fft` keeps float32 inputs in single precision as TensorFlow does
+    # which matters for the phase of low-energy bins
+    import scipy.fft
+    num_frames = 1 + (signals.shape[-1] - frame_length) // frame_step
+    indices = np.arange(num_frames)[:, np.newaxis] * frame_step + np.arange(frame_length)
+    frames = signals[..., indices] * window
+    return scipy.fft.rfft(frames, n=frame_length, axis=-1)
+
+
+def inverse_stft(stfts, frame_length, frame_step, window):
+    # same as `tf.signal.inverse_stft` with `fft_length=frame_length`
+    import scipy.fft
+    frames = scipy.fft.irfft(stfts, n=frame_length, axis=-1) * window
+    num_frames = frames.shape[-2]
+    signals = np.zeros(frames.shape[:-2] + (frame_step * (num_frames - 1) + frame_length,), dtype=frames.dtype)
+    for i in range(num_frames):
+        signals[..., i * frame_step:i * frame_step + frame_length] += frames[..., i, :]
+    return signals
+
+
+@functools.lru_cache(maxsize=None)
+def spectral_constants(sample_rate, spectrogram_shape, overlap):
+
+    # computed once per process and `spectral_params`
+    time_steps, num_freq_bins = spectrogram_shape
+    frame_length = num_freq_bins * 2
+    frame_step = int((1.0 - overlap) * frame_length)
+    linear_to_mel_matrix, mel_to_linear_matrix = mel_weight_matrices(sample_rate, num_freq_bins)
+
+    return Struct(
+        frame_length=frame_length,
+        frame_step=frame_step,
+        num_samples=frame_step * (time_steps - 1) + frame_length,
+        linear_to_mel_weight_matrix=linear_to_mel_matrix,
+        mel_to_linear_weight_matrix=mel_to_linear_matrix,
+        forward_window=hann_window(frame_length).astype(np.float32),
+        inverse_window=inverse_hann_window(frame_length, frame_step).astype(np.float32)
+    )
+
+
+def convert_to_spectrogram(waveforms, waveform_length, sample_rate, spectrogram_shape, overlap):
+
+    def normalize(inputs, mean, stddev):
+        return (inputs - mean) / stddev
+
+    constants = spectral_constants(sample_rate, tuple(spectrogram_shape), overlap)
+
+    # For Nsynth dataset, we are putting all padding in the front
+    # This causes edge effects in the tail
+    waveforms = np.asarray(waveforms, dtype=np.float32)
+    waveforms = np.pad(waveforms, [[0, 0], [constants.num_samples - waveform_length, 0]], mode="constant")
+
+    stfts = stft(
+        signals=waveforms,
+        frame_length=constants.frame_length,
+        frame_step=constants.frame_step,
+        window=constants.forward_window
+    )
+    # discard_dc
+    stfts = stfts[..., 1:]
+
+    magnitude_spectrograms = np.abs(stfts).astype(np.float32)
+    phase_spectrograms = np.angle(stfts).astype(np.float32)
+
+    linear_to_mel_weight_matrix = constants.linear_to_mel_weight_matrix
+    mel_magnitude_spectrograms = np.tensordot(magnitude_spectrograms, linear_to_mel_weight_matrix, axes=1)
+    mel_phase_spectrograms = np.tensordot(phase_spectrograms, linear_to_mel_weight_matrix, axes=1)
+
+    log_mel_magnitude_spectrograms = np.log(mel_magnitude_spectrograms + 1.0e-6)
+    mel_instantaneous_frequencies = instantaneous_frequency(mel_phase_spectrograms, axis=-2)
+
+    log_mel_magnitude_spectrograms = normalize(log_mel_magnitude_spectrograms, -3.76, 10.05)
+    mel_instantaneous_frequencies = normalize(mel_instantaneous_frequencies, 0.0, 1.0)
+
+    return log_mel_magnitude_spectrograms, mel_instantaneous_frequencies
+
+
+def convert_to_waveform(log_mel_magnitude_spectrograms, mel_instantaneous_frequencies, waveform_length, sample_rate, spectrogram_shape, overlap):
+
+    def unnormalize(inputs, mean, stddev):
+        return inputs * stddev + mean
+
+    constants = spectral_constants(sample_rate, tuple(spectrogram_shape), overlap)
+
+    log_mel_magnitude_spectrograms = unnormalize(np.asarray(log_mel_magnitude_spectrograms, dtype=np.float32), -3.76, 10.05)
+    mel_instantaneous_frequencies = unnormalize(np.asarray(mel_instantaneous_frequencies, dtype=np.float32), 0.0, 1.0)
+
+    mel_magnitude_spectrograms = np.exp(log_mel_magnitude_spectrograms)
+    mel_phase_spectrograms = np.cumsum(mel_instantaneous_frequencies * np.float32(np.pi), axis=-2)
+
+    mel_to_linear_weight_matrix = constants.mel_to_linear_weight_matrix
+    magnitudes = np.tensordot(mel_magnitude_spectrograms, mel_to_linear_weight_matrix, axes=1)
+    phase_spectrograms = np.tensordot(mel_phase_spectrograms, mel_to_linear_weight_matrix, axes=1)
+
+    stfts = magnitudes * np.exp(1.0j * phase_spectrograms).astype(np.complex64)
+
+    # discard_dc
+    stfts = np.pad(stfts, [[0, 0], [0, 0], [1, 0]], mode="constant")
+    waveforms = inverse_stft(
+        stfts=stfts,
+        frame_length=constants.frame_length,
+        frame_step=constants.frame_step,
+        window=constants.inverse_window
+    ).astype(np.float32)
+
+    # For Nsynth dataset, we are putting all padding in the front
+    # This causes edge effects in the tail
+    waveforms = waveforms[:, constants.num_samples - waveform_length:]
+
+    return waveforms
+
+
+def apply_batch(function, kwargs, batch):
+    return function(*batch, **kwargs)
+
+
+def parallel_map(function, inputs, batch_size, processes=None, **kwargs):
+
+    # apply `function` (e.g. `convert_to_spectrogram`) to batches of `inputs` across a process pool
+    # `inputs` is a tuple of arrays split along the first axis and passed as positional arguments
+    # outputs are concatenated in input order
+    num_examples = len(inputs[0])
+    batches = [
+        tuple(array[begin:begin + batch_size] for array in inputs)
+        for begin in range(0, num_examples, batch_size)
+    ]
+
+    with multiprocessing.Pool(processes) as pool:
+        outputs = pool.map(functools.partial(apply_batch, function, kwargs), batches)
+
+    if isinstance(outputs[0], tuple):
+        return tuple(map(np.concatenate, zip(*outputs)))
+
+    return np.concatenate(outputs)
+
+
+if __name__ == "__main__":
+
+    # check against the TensorFlow implementation
+    import tensorflow as tf
+    import spectral_ops
+
+    spectral_params = dict(
+        waveform_length=64000,
+        sample_rate=16000,
+        spectrogram_shape=[128, 1024],
+        overlap=0.75
+    )
+
+    # decaying harmonic tones
+    times = np.arange(spectral_params["waveform_length"]) / spectral_params["sample_rate"]
+    waveforms = np.stack([
+        sum(np.sin(2.0 * np.pi * 440.0 * 2.0 ** ((pitch - 69) / 12.0) * harmonic * times) / harmonic for harmonic in range(1, 5))
+        * np.exp(-times) * 0.25 for pitch in range(24, 85, 6)
+    ]).astype(np.float32)
+
+    magnitude_spectrograms, instantaneous_frequencies = parallel_map(convert_to_spectrogram, (waveforms,), batch_size=4, **spectral_params)
+    reconstructions = parallel_map(convert_to_waveform, (magnitude_spectrograms, instantaneous_frequencies), batch_size=4, **spectral_params)
+
+    with tf.Graph().as_default():
+        tf_spectrograms = spectral_ops.convert_to_spectrogram(tf.constant(waveforms), **spectral_params)
+        tf_reconstructions = spectral_ops.convert_to_waveform(*map(tf.constant, (magnitude_spectrograms, instantaneous_frequencies)), **spectral_params)
+        with tf.Session() as session:
+            (tf_magnitude_spectrograms, tf_instantaneous_frequencies), tf_reconstructions = session.run([tf_spectrograms, tf_reconstructions])
+
+    for name, value, expected in [
+        ("log_mel_magnitude_spectrograms", magnitude_spectrograms, tf_magnitude_spectrograms),
+        ("mel_instantaneous_frequencies", instantaneous_frequencies, tf_instantaneous_frequencies),
+        ("waveforms", reconstructions, tf_reconstructions),
+    ]:
+        errors = np.abs(value - expected)
+        print(f"{name}: max error {errors.max():.3e}, mean error {errors.mean():.3e}")
@@ -117,31 +117,41 @@ def batch_normalization(inputs, training, momentum=0.99, epsilon=1.0e-12):
     return inputs
 
 
-def group_normalization(inputs, groups, epsilon=1.0e-12):
+def group_normalization(inputs, groups, epsilon=1.0e-12, data_format="NCHW"):
     ''' Group Normalization
     [Group Normalization]
     (https://arxiv.org/pdf/1803.08494.pdf)
     '''
     shape = inputs.shape.as_list()
-    inputs = tf.reshape(inputs, [-1, groups, shape[1] // groups, *shape[2:]])
+    if data_format == "NCHW":
+        inputs = tf.reshape(inputs, [-1, groups, shape[1] // groups, *shape[2:]])
+        axes = list(range(2, len(shape) + 1))
+    else:
+        inputs = tf.reshape(inputs, [-1, *shape[1:-1], groups, shape[-1] // groups])
+        axes = list(range(1, len(shape) - 1)) + [len(shape)]
     mean, variance = tf.nn.moments(
         x=inputs,
-        axes=list(range(2, len(shape) + 1)),
+        axes=axes,
         keep_dims=True
     )
     stddev = tf.sqrt(variance + epsilon)
     inputs = (inputs - mean) / stddev
     inputs = tf.reshape(inputs, [-1, *shape[1:]])
+    # the variables keep the NCHW shape in either data format (checkpoint compatibility)
+    channels = shape[1] if data_format == "NCHW" else shape[-1]
     beta = tf.get_variable(
         name="beta",
-        shape=[1, shape[1]] + [1] * len(shape[2:]),
+        shape=[1, channels] + [1] * len(shape[2:]),
         initializer=tf.initializers.zeros()
     )
     gamma = tf.get_variable(
         name="gamma",
-        shape=[1, shape[1]] + [1] * len(shape[2:]),
+        shape=[1, channels] + [1] * len(shape[2:]),
         initializer=tf.initializers.ones()
     )
+    if data_format == "NHWC":
+        beta = tf.reshape(beta, [1] * len(shape[:-1]) + [channels])
+        gamma = tf.reshape(gamma, [1] * len(shape[:-1]) + [channels])
     inputs = inputs * gamma + beta
     return inputs
 
@@ -153,11 +163,12 @@ def get_weight(shape,
                apply_spectral_normalization=False):
     stddev = np.sqrt(variance_scale / np.prod(shape[:-1]))
     if scale_weight:
-        weight = tf.get_variable(
+        # equalized learning rate (the scaled weight is folded into a constant by `export_generator.py`)
+        weight = tf.multiply(tf.get_variable(
             name="weight",
             shape=shape,
             initializer=tf.initializers.truncated_normal(0.0, 1.0)
-        ) * stddev
+        ), stddev, name="scaled_weight")
     else:
         weight = tf.get_variable(
             name="weight",
@@ -226,9 +237,11 @@ def conv2d(inputs,
            variance_scale=2.0,
            scale_weight=False,
            apply_weight_standardization=False,
-           apply_spectral_normalization=False):
+           apply_spectral_normalization=False,
+           data_format="NCHW"):
+    channels_axis = 1 if data_format == "NCHW" else 3
     weight = get_weight(
-        shape=[*kernel_size, inputs.shape[1].value, filters],
+        shape=[*kernel_size, inputs.shape[channels_axis].value, filters],
         variance_scale=variance_scale,
         scale_weight=scale_weight,
         apply_weight_standardization=apply_weight_standardization,
@@ -237,13 +250,13 @@ def conv2d(inputs,
     inputs = tf.nn.conv2d(
         input=inputs,
         filter=weight,
-        strides=[1, 1] + strides,
+        strides=[1, 1] + strides if data_format == "NCHW" else [1] + strides + [1],
         padding="SAME",
-        data_format="NCHW"
+        data_format=data_format
     )
     if use_bias:
-        bias = get_bias([inputs.shape[1].value])
-        inputs = tf.nn.bias_add(inputs, bias, data_format="NCHW")
+        bias = get_bias([inputs.shape[channels_axis].value])
+        inputs = tf.nn.bias_add(inputs, bias, data_format=data_format)
     return inputs
 
 
@@ -255,9 +268,11 @@ def conv2d_transpose(inputs,
                      variance_scale=2.0,
                      scale_weight=False,
                      apply_weight_standardization=False,
-                     apply_spectral_normalization=False):
+                     apply_spectral_normalization=False,
+                     data_format="NCHW"):
+    channels_axis = 1 if data_format == "NCHW" else 3
     weight = get_weight(
-        shape=[*kernel_size, inputs.shape[1].value, filters],
+        shape=[*kernel_size, inputs.shape[channels_axis].value, filters],
         variance_scale=variance_scale,
         scale_weight=scale_weight,
         apply_weight_standardization=apply_weight_standardization,
@@ -265,84 +280,95 @@ def conv2d_transpose(inputs,
     )
     weight = tf.transpose(weight, [0, 1, 3, 2])
     input_shape = np.array(inputs.shape.as_list())
-    output_shape = [input_shape[0], filters, *input_shape[2:] * strides]
+    # the batch size may be unknown (e.g. in an inference graph)
+    if data_format == "NCHW":
+        output_shape = [input_shape[0] or tf.shape(inputs)[0], filters, *input_shape[2:] * strides]
+    else:
+        output_shape = [input_shape[0] or tf.shape(inputs)[0], *input_shape[1:3] * strides, filters]
     inputs = tf.nn.conv2d_transpose(
         value=inputs,
         filter=weight,
         output_shape=output_shape,
-        strides=[1, 1] + strides,
+        strides=[1, 1] + strides if data_format == "NCHW" else [1] + strides + [1],
         padding="SAME",
-        data_format="NCHW"
+        data_format=data_format
     )
     if use_bias:
-        bias = get_bias([inputs.shape[1].value])
-        inputs = tf.nn.bias_add(inputs, bias, data_format="NCHW")
+        bias = get_bias([inputs.shape[channels_axis].value])
+        inputs = tf.nn.bias_add(inputs, bias, data_format=data_format)
     return inputs
 
 
-def upscale2d(inputs, factors=[2, 2]):
+def upscale2d(inputs, factors=[2, 2], data_format="NCHW"):
     factors = np.asanyarray(factors)
     if (factors == 1).all():
         return inputs
     shape = inputs.shape.as_list()
-    inputs = tf.reshape(inputs, [-1, shape[1], shape[2], 1, shape[3], 1])
-    inputs = tf.tile(inputs, [1, 1, 1, factors[0], 1, factors[1]])
-    inputs = tf.reshape(inputs, [-1, shape[1], shape[2] * factors[0], shape[3] * factors[1]])
+    if data_format == "NCHW":
+        inputs = tf.reshape(inputs, [-1, shape[1], shape[2], 1, shape[3], 1])
+        inputs = tf.tile(inputs, [1, 1, 1, factors[0], 1, factors[1]])
+        inputs = tf.reshape(inputs, [-1, shape[1], shape[2] * factors[0], shape[3] * factors[1]])
+    else:
+        inputs = tf.reshape(inputs, [-1, shape[1], 1, shape[2], 1, shape[3]])
+        inputs = tf.tile(inputs, [1, 1, factors[0], 1, factors[1], 1])
+        inputs = tf.reshape(inputs, [-1, shape[1] * factors[0], shape[2] * factors[1], shape[3]])
     return inputs
 
 
-def downscale2d(inputs, factors=[2, 2]):
+def downscale2d(inputs, factors=[2, 2], data_format="NCHW"):
     factors = np.asanyarray(factors)
     if (factors == 1).all():
         return inputs
     inputs = tf.nn.avg_pool(
         value=inputs,
-        ksize=[1, 1, *factors],
-        strides=[1, 1, *factors],
+        ksize=[1, 1, *factors] if data_format == "NCHW" else [1, *factors, 1],
+        strides=[1, 1, *factors] if data_format == "NCHW" else [1, *factors, 1],
         padding="SAME",
-        data_format="NCHW"
+        data_format=data_format
     )
     return inputs
 
 
-def max_pooling2d(inputs, kernel_size, strides):
+def max_pooling2d(inputs, kernel_size, strides, data_format="NCHW"):
     inputs = tf.nn.max_pool(
         value=inputs,
-        ksize=[1, 1, *kernel_size],
-        strides=[1, 1, *strides],
+        ksize=[1, 1, *kernel_size] if data_format == "NCHW" else [1, *kernel_size, 1],
+        strides=[1, 1, *strides] if data_format == "NCHW" else [1, *strides, 1],
         padding="SAME",
-        data_format="NCHW"
+        data_format=data_format
     )
     return inputs
 
 
-def average_pooling2d(inputs, kernel_size, strides):
+def average_pooling2d(inputs, kernel_size, strides, data_format="NCHW"):
     inputs = tf.nn.avg_pool(
         value=inputs,
-        ksize=[1, 1, *kernel_size],
-        strides=[1, 1, *strides],
+        ksize=[1, 1, *kernel_size] if data_format == "NCHW" else [1, *kernel_size, 1],
+        strides=[1, 1, *strides] if data_format == "NCHW" else [1, *strides, 1],
         padding="SAME",
-        data_format="NCHW"
+        data_format=data_format
     )
     return inputs
 
 
-def pixel_normalization(inputs, epsilon=1.0e-12):
-    pixel_norm = tf.sqrt(tf.reduce_mean(tf.square(inputs), axis=1, keepdims=True) + epsilon)
+def pixel_normalization(inputs, epsilon=1.0e-12, data_format="NCHW"):
+    pixel_norm = tf.sqrt(tf.reduce_mean(tf.square(inputs), axis=1 if data_format == "NCHW" else 3, keepdims=True) + epsilon)
     inputs = inputs / pixel_norm
     return inputs
 
 
-def batch_stddev(inputs, groups=4, epsilon=1.0e-12):
+def batch_stddev(inputs, groups=4, epsilon=1.0e-12, data_format="NCHW"):
     # NOTE: when using tf.moments to calculate variance
     # NOTE: the loss explodes in the middle of training
     # NOTE: sinse it uses tf.stop_gradient in tf.moments (?)
     shape = inputs.shape
+    # the group size can't exceed the batch size (e.g. small batches at high resolutions)
+    groups = min(groups, shape.as_list()[0] or groups)
     inputs = tf.reshape(inputs, [groups, -1, *shape[1:]])
     inputs -= tf.reduce_mean(inputs, axis=0, keepdims=True)
     inputs = tf.square(inputs)
     inputs = tf.reduce_mean(inputs, axis=0)
     inputs = tf.sqrt(inputs + epsilon)
     inputs = tf.reduce_mean(inputs, axis=[1, 2, 3], keepdims=True)
-    inputs = tf.tile(inputs, [groups, 1, *shape[2:]])
+    inputs = tf.tile(inputs, [groups, 1, *shape[2:]] if data_format == "NCHW" else [groups, *shape[1:3], 1])
     return inputs
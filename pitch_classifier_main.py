@@ -15,24 +15,72 @@ import numpy as np
 import functools
 import argparse
 import glob
-from dataset import nsynth_input_fn
+from dataset import nsynth_input_fn, nsynth_pcm_input_fn
 from models import PitchClassifier
 from networks import ResNet
 from utils import Struct
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--model_dir", type=str, default="pitch_classifier_model")
-parser.add_argument('--filenames', type=str, default="nsynth*.tfrecord")
+parser.add_argument('--filenames', type=str, default="nsynth_train-*.tfrecord")
 parser.add_argument("--batch_size", type=int, default=64)
+# gradients are averaged over `accumulation_steps` micro-batches of `batch_size` per update
+parser.add_argument("--accumulation_steps", type=int, default=1)
 parser.add_argument("--num_epochs", type=int, default=100)
+# the shuffle buffer size in examples (the whole dataset for waveform records, 4096 for spectrogram records by default)
+parser.add_argument("--buffer_size", type=int, default=None)
+# save the input iterator (its position and shuffle buffer) with every checkpoint so that resumed training doesn't re-see data
+# the shuffle buffer is written into each checkpoint, so keep `--buffer_size` small with it
+parser.add_argument('--save_iterator_state', action="store_true")
 parser.add_argument("--total_steps", type=int, default=50000)
+parser.add_argument('--spectrograms', action="store_true")
+parser.add_argument("--codec", type=str, default="float32", choices=["float32", "float16", "uint8"])
+parser.add_argument('--pcm', action="store_true")
+# the layout of the feature maps in the networks (NHWC for CPU), checkpoints are compatible across layouts
+parser.add_argument("--data_format", type=str, default="NCHW", choices=["NCHW", "NHWC"])
+parser.add_argument("--num_parallel_reads", type=int, default=None)
+parser.add_argument("--num_parallel_calls", type=int, default=None)
+parser.add_argument("--prefetch_buffer_size", type=int, default=None)
+parser.add_argument("--cache_filename", type=str, default=None)
+parser.add_argument("--index_filename", type=str, default=None)
+parser.add_argument("--families", type=int, nargs="+", default=None)
+parser.add_argument("--velocities", type=int, nargs="+", default=None)
+# between-graph replicated data-parallel training (see `launch_local_cluster.py`)
+parser.add_argument("--job_name", type=str, default="", choices=["", "ps", "worker"])
+parser.add_argument("--task_index", type=int, default=0)
+parser.add_argument("--ps_hosts", type=str, nargs="+", default=[])
+parser.add_argument("--worker_hosts", type=str, nargs="+", default=[])
 parser.add_argument('--train', action="store_true")
 parser.add_argument('--evaluate', action="store_true")
 args = parser.parse_args()
 
 tf.logging.set_verbosity(tf.logging.INFO)
 
-with tf.Graph().as_default():
+if args.job_name:
+    cluster = tf.train.ClusterSpec(dict(
+        ps=args.ps_hosts,
+        worker=args.worker_hosts
+    ))
+    server = tf.train.Server(
+        server_or_cluster_def=cluster,
+        job_name=args.job_name,
+        task_index=args.task_index
+    )
+    if args.job_name == "ps":
+        server.join()
+    master = server.target
+    num_workers = len(args.worker_hosts)
+    # variables on the parameter servers and everything else on this worker
+    device_setter = tf.train.replica_device_setter(
+        worker_device=f"/job:worker/task:{args.task_index}",
+        cluster=cluster
+    )
+else:
+    master = ""
+    num_workers = 1
+    device_setter = None
+
+with tf.Graph().as_default(), tf.device(device_setter):
 
     tf.set_random_seed(0)
 
@@ -46,20 +94,57 @@ with tf.Graph().as_default():
             Struct(filters=512, strides=[2, 2], blocks=3)
         ],
         groups=32,
-        classes=len(range(24, 85))
+        classes=len(range(24, 85)),
+        data_format=args.data_format
     )
 
-    pitch_classifier = PitchClassifier(
-        network=resnet,
-        input_fn=functools.partial(
+    if args.pcm:
+        input_fn = functools.partial(
+            nsynth_pcm_input_fn,
+            filenames=glob.glob(args.filenames),
+            batch_size=args.batch_size,
+            num_epochs=args.num_epochs if args.train else 1,
+            shuffle=True if args.train else False,
+            buffer_size=args.buffer_size,
+            pitches=range(24, 85),
+            sources=[0],
+            num_parallel_reads=args.num_parallel_reads,
+            num_parallel_calls=args.num_parallel_calls,
+            prefetch_buffer_size=args.prefetch_buffer_size,
+            save_iterator_state=args.save_iterator_state and args.train and num_workers == 1,
+            index_filename=args.index_filename,
+            families=args.families,
+            velocities=args.velocities,
+            num_shards=num_workers,
+            shard_index=args.task_index
+        )
+    else:
+        input_fn = functools.partial(
             nsynth_input_fn,
             filenames=glob.glob(args.filenames),
             batch_size=args.batch_size,
             num_epochs=args.num_epochs if args.train else 1,
             shuffle=True if args.train else False,
+            buffer_size=args.buffer_size,
             pitches=range(24, 85),
-            sources=[0]
-        ),
+            sources=[0],
+            image_shape=[2, 128, 1024] if args.spectrograms else None,
+            num_parallel_reads=args.num_parallel_reads,
+            num_parallel_calls=args.num_parallel_calls,
+            prefetch_buffer_size=args.prefetch_buffer_size,
+            save_iterator_state=args.save_iterator_state and args.train and num_workers == 1,
+            cache_filename=args.cache_filename,
+            index_filename=args.index_filename,
+            families=args.families,
+            velocities=args.velocities,
+            image_codec=args.codec,
+            num_shards=num_workers,
+            shard_index=args.task_index
+        )
+
+    pitch_classifier = PitchClassifier(
+        network=resnet,
+        input_fn=input_fn,
         spectral_params=Struct(
             waveform_length=64000,
             sample_rate=16000,
@@ -71,13 +156,15 @@ with tf.Graph().as_default():
         hyper_params=Struct(
             weight_decay=1e-4,
             learning_rate=lambda global_step: tf.train.exponential_decay(
-                learning_rate=0.128 * args.batch_size / 256,
+                learning_rate=0.128 * args.batch_size * args.accumulation_steps * num_workers / 256,
                 global_step=global_step,
-                decay_steps=70000 * args.num_epochs / 4 / args.batch_size,
+                decay_steps=70000 * args.num_epochs / 4 / (args.batch_size * args.accumulation_steps * num_workers),
                 decay_rate=0.1
             ),
             momentum=0.9,
-            use_nesterov=True
+            use_nesterov=True,
+            accumulation_steps=args.accumulation_steps,
+            num_workers=num_workers
         )
     )
 
@@ -94,7 +181,9 @@ with tf.Graph().as_default():
             total_steps=args.total_steps,
             save_checkpoint_steps=1000,
             save_summary_steps=100,
-            log_tensor_steps=100
+            log_tensor_steps=100,
+            master=master,
+            is_chief=args.task_index == 0
         )
 
     if args.evaluate:
@@ -1,8 +1,8 @@
 import tensorflow as tf
-import tensorflow_probability as tfp
 import numpy as np
-import functools
-import glob
+import weakref
+import os
+from numpy_spectral_ops import mel_weight_matrices, hann_window, inverse_hann_window
 
 
 def diff(inputs, axis=-1):
@@ -42,186 +42,260 @@ def instantaneous_frequency(phases, axis=-2):
     return diffs
 
 
-def convert_to_spectrogram(waveforms, waveform_length, sample_rate, spectrogram_shape, overlap):
+class SpectralTransform(object):
+
+    # precomputes the mel matrix, its pseudo-inverse and the STFT windows once per `spectral_params`
+    # instead of rebuilding them (and running an SVD) in every graph that converts spectrograms
+    # the matrices are cached on disk across runs and embedded as constants once per graph
+
+    def __init__(self, waveform_length, sample_rate, spectrogram_shape, overlap,
+                 cache_dir=os.path.join(os.path.expanduser("~"), ".cache", "gan_synth")):
+
+        self.waveform_length = waveform_length
+        self.sample_rate = sample_rate
+        self.spectrogram_shape = spectrogram_shape
+        self.overlap = overlap
 
-    def normalize(inputs, mean, stddev):
-        return (inputs - mean) / stddev
-
-    time_steps, num_freq_bins = spectrogram_shape
-    frame_length = num_freq_bins * 2
-    frame_step = int((1.0 - overlap) * frame_length)
-    num_samples = frame_step * (time_steps - 1) + frame_length
-
-    # For Nsynth dataset, we are putting all padding in the front
-    # This causes edge effects in the tail
-    waveforms = tf.pad(waveforms, [[0, 0], [num_samples - waveform_length, 0]])
-
-    stfts = tf.signal.stft(
-        signals=waveforms,
-        frame_length=frame_length,
-        frame_step=frame_step,
-        window_fn=functools.partial(
-            tf.signal.hann_window,
-            periodic=True
+        self.time_steps, self.num_freq_bins = spectrogram_shape
+        self.frame_length = self.num_freq_bins * 2
+        self.frame_step = int((1.0 - overlap) * self.frame_length)
+        self.num_samples = self.frame_step * (self.time_steps - 1) + self.frame_length
+
+        self.linear_to_mel_weight_matrix, self.mel_to_linear_weight_matrix = mel_weight_matrices(
+            sample_rate=sample_rate,
+            num_freq_bins=self.num_freq_bins,
+            cache_dir=cache_dir
         )
-    )
-    # discard_dc
-    stfts = stfts[..., 1:]
 
-    magnitude_spectrograms = tf.abs(stfts)
-    phase_spectrograms = tf.angle(stfts)
+        # the streaming inverse converts its (unbounded) cumulative phases in double precision
+        self.mel_to_linear_weight_matrix_float64 = self.mel_to_linear_weight_matrix.astype(np.float64)
 
-    # this matrix can be constant by graph optimization `Constant Folding`
-    # since there are no Tensor inputs
-    linear_to_mel_weight_matrix = tf.signal.linear_to_mel_weight_matrix(
-        num_mel_bins=num_freq_bins,
-        num_spectrogram_bins=num_freq_bins,
-        sample_rate=sample_rate,
-        lower_edge_hertz=0.0,
-        upper_edge_hertz=sample_rate / 2.0
-    )
-    mel_magnitude_spectrograms = tf.tensordot(magnitude_spectrograms, linear_to_mel_weight_matrix, axes=1)
-    mel_magnitude_spectrograms.set_shape(magnitude_spectrograms.shape[:-1].concatenate(linear_to_mel_weight_matrix.shape[-1:]))
-    mel_phase_spectrograms = tf.tensordot(phase_spectrograms, linear_to_mel_weight_matrix, axes=1)
-    mel_phase_spectrograms.set_shape(phase_spectrograms.shape[:-1].concatenate(linear_to_mel_weight_matrix.shape[-1:]))
+        self.forward_window = hann_window(self.frame_length).astype(np.float32)
+        self.inverse_window = inverse_hann_window(self.frame_length, self.frame_step).astype(np.float32)
 
-    log_mel_magnitude_spectrograms = tf.log(mel_magnitude_spectrograms + 1.0e-6)
-    mel_instantaneous_frequencies = instantaneous_frequency(mel_phase_spectrograms, axis=-2)
+        self.constants = weakref.WeakKeyDictionary()
+        self.streams = weakref.WeakKeyDictionary()
 
-    log_mel_magnitude_spectrograms = normalize(log_mel_magnitude_spectrograms, -3.76, 10.05)
-    mel_instantaneous_frequencies = normalize(mel_instantaneous_frequencies, 0.0, 1.0)
+    def constant(self, name):
+        # one constant per graph, created outside of any control flow context
+        # so that it can be shared by every conversion in the graph
+        graph = tf.get_default_graph()
+        constants = self.constants.setdefault(graph, {})
+        if name not in constants:
+            with tf.init_scope():
+                constants[name] = tf.constant(getattr(self, name), name=name)
+        return constants[name]
 
-    return log_mel_magnitude_spectrograms, mel_instantaneous_frequencies
+    def convert_to_spectrogram(self, waveforms):
 
+        def normalize(inputs, mean, stddev):
+            return (inputs - mean) / stddev
 
-def convert_to_waveform(log_mel_magnitude_spectrograms, mel_instantaneous_frequencies, waveform_length, sample_rate, spectrogram_shape, overlap):
+        # For Nsynth dataset, we are putting all padding in the front
+        # This causes edge effects in the tail
+        waveforms = tf.pad(waveforms, [[0, 0], [self.num_samples - self.waveform_length, 0]])
+
+        stfts = tf.signal.stft(
+            signals=waveforms,
+            frame_length=self.frame_length,
+            frame_step=self.frame_step,
+            window_fn=lambda frame_length, dtype: self.constant("forward_window")
+        )
+        # discard_dc
+        stfts = stfts[..., 1:]
+
+        magnitude_spectrograms = tf.abs(stfts)
+        phase_spectrograms = tf.angle(stfts)
+
+        linear_to_mel_weight_matrix = self.constant("linear_to_mel_weight_matrix")
+        mel_magnitude_spectrograms = tf.tensordot(magnitude_spectrograms, linear_to_mel_weight_matrix, axes=1)
+        mel_magnitude_spectrograms.set_shape(magnitude_spectrograms.shape[:-1].concatenate(linear_to_mel_weight_matrix.shape[-1:]))
+        mel_phase_spectrograms = tf.tensordot(phase_spectrograms, linear_to_mel_weight_matrix, axes=1)
+        mel_phase_spectrograms.set_shape(phase_spectrograms.shape[:-1].concatenate(linear_to_mel_weight_matrix.shape[-1:]))
+
+        log_mel_magnitude_spectrograms = tf.log(mel_magnitude_spectrograms + 1.0e-6)
+        mel_instantaneous_frequencies = instantaneous_frequency(mel_phase_spectrograms, axis=-2)
+
+        log_mel_magnitude_spectrograms = normalize(log_mel_magnitude_spectrograms, -3.76, 10.05)
+        mel_instantaneous_frequencies = normalize(mel_instantaneous_frequencies, 0.0, 1.0)
+
+        return log_mel_magnitude_spectrograms, mel_instantaneous_frequencies
+
+    def convert_to_waveform(self, log_mel_magnitude_spectrograms, mel_instantaneous_frequencies):
+
+        def unnormalize(inputs, mean, stddev):
+            return inputs * stddev + mean
 
-    def unnormalize(inputs, mean, stddev):
-        return inputs * stddev + mean
-
-    time_steps, num_freq_bins = spectrogram_shape
-    frame_length = num_freq_bins * 2
-    frame_step = int((1.0 - overlap) * frame_length)
-    num_samples = frame_step * (time_steps - 1) + frame_length
-
-    log_mel_magnitude_spectrograms = unnormalize(log_mel_magnitude_spectrograms, -3.76, 10.05)
-    mel_instantaneous_frequencies = unnormalize(mel_instantaneous_frequencies, 0.0, 1.0)
-
-    mel_magnitude_spectrograms = tf.exp(log_mel_magnitude_spectrograms)
-    mel_phase_spectrograms = tf.cumsum(mel_instantaneous_frequencies * np.pi, axis=-2)
-
-    # this matrix can be constant by graph optimization `Constant Folding`
-    # since there are no Tensor inputs
-    linear_to_mel_weight_matrix = tf.signal.linear_to_mel_weight_matrix(
-        num_mel_bins=num_freq_bins,
-        num_spectrogram_bins=num_freq_bins,
-        sample_rate=sample_rate,
-        lower_edge_hertz=0.0,
-        upper_edge_hertz=sample_rate / 2.0
-    )
-    mel_to_linear_weight_matrix = tfp.math.pinv(linear_to_mel_weight_matrix)
-    magnitudes = tf.tensordot(mel_magnitude_spectrograms, mel_to_linear_weight_matrix, axes=1)
-    magnitudes.set_shape(mel_magnitude_spectrograms.shape[:-1].concatenate(mel_to_linear_weight_matrix.shape[-1:]))
-    phase_spectrograms = tf.tensordot(mel_phase_spectrograms, mel_to_linear_weight_matrix, axes=1)
-    phase_spectrograms.set_shape(mel_phase_spectrograms.shape[:-1].concatenate(mel_to_linear_weight_matrix.shape[-1:]))
-
-    stfts = tf.complex(magnitudes, 0.0) * tf.complex(tf.cos(phase_spectrograms), tf.sin(phase_spectrograms))
-
-    # discard_dc
-    stfts = tf.pad(stfts, [[0, 0], [0, 0], [1, 0]])
-    waveforms = tf.signal.inverse_stft(
-        stfts=stfts,
-        frame_length=frame_length,
-        frame_step=frame_step,
-        window_fn=tf.signal.inverse_stft_window_fn(
-            frame_step=frame_step,
-            forward_window_fn=functools.partial(
-                tf.signal.hann_window,
-                periodic=True
-            )
+        log_mel_magnitude_spectrograms = unnormalize(log_mel_magnitude_spectrograms, -3.76, 10.05)
+        mel_instantaneous_frequencies = unnormalize(mel_instantaneous_frequencies, 0.0, 1.0)
+
+        mel_magnitude_spectrograms = tf.exp(log_mel_magnitude_spectrograms)
+        mel_phase_spectrograms = tf.cumsum(mel_instantaneous_frequencies * np.pi, axis=-2)
+
+        mel_to_linear_weight_matrix = self.constant("mel_to_linear_weight_matrix")
+        magnitudes = tf.tensordot(mel_magnitude_spectrograms, mel_to_linear_weight_matrix, axes=1)
+        magnitudes.set_shape(mel_magnitude_spectrograms.shape[:-1].concatenate(mel_to_linear_weight_matrix.shape[-1:]))
+        phase_spectrograms = tf.tensordot(mel_phase_spectrograms, mel_to_linear_weight_matrix, axes=1)
+        phase_spectrograms.set_shape(mel_phase_spectrograms.shape[:-1].concatenate(mel_to_linear_weight_matrix.shape[-1:]))
+
+        stfts = tf.complex(magnitudes, 0.0) * tf.complex(tf.cos(phase_spectrograms), tf.sin(phase_spectrograms))
+
+        # discard_dc
+        stfts = tf.pad(stfts, [[0, 0], [0, 0], [1, 0]])
+        waveforms = tf.signal.inverse_stft(
+            stfts=stfts,
+            frame_length=self.frame_length,
+            frame_step=self.frame_step,
+            window_fn=lambda frame_length, dtype: self.constant("inverse_window")
         )
-    )
 
-    # For Nsynth dataset, we are putting all padding in the front
-    # This causes edge effects in the tail
-    waveforms = waveforms[:, num_samples - waveform_length:]
+        # For Nsynth dataset, we are putting all padding in the front
+        # This causes edge effects in the tail
+        waveforms = waveforms[:, self.num_samples - self.waveform_length:]
+
+        return waveforms
+
+    def convert_to_waveform_block(self, log_mel_magnitude_spectrograms, mel_instantaneous_frequencies, mel_phases, overlaps):
+
+        # streaming variant of `convert_to_waveform` for chunks of [batch, frames, bins]
+        # `mel_phases` [batch, bins] (float64) carries the cumulative phase (cumsum of IF) across chunks
+        # in double precision since it grows without bound over a long render
+        # (it can't be wrapped mod 2pi itself since the linear phases are a non-integer mix of it)
+        # and the linear phases are wrapped mod 2pi before they are cast back to single precision
+        # `overlaps` [batch, frame_length - frame_step] carries the overlap-add tail across chunks
+        # returns `frame_step * frames` samples per chunk and the updated states
+        # so memory is constant in the output length
+
+        def unnormalize(inputs, mean, stddev):
+            return inputs * stddev + mean
+
+        log_mel_magnitude_spectrograms = unnormalize(log_mel_magnitude_spectrograms, -3.76, 10.05)
+        mel_instantaneous_frequencies = unnormalize(mel_instantaneous_frequencies, 0.0, 1.0)
+
+        mel_magnitude_spectrograms = tf.exp(log_mel_magnitude_spectrograms)
+        mel_phase_spectrograms = tf.cumsum(tf.cast(mel_instantaneous_frequencies, tf.float64) * np.pi, axis=-2) + mel_phases[:, tf.newaxis, :]
+        mel_phases = mel_phase_spectrograms[:, -1, :]
+
+        magnitudes = tf.tensordot(mel_magnitude_spectrograms, self.constant("mel_to_linear_weight_matrix"), axes=1)
+        phase_spectrograms = tf.tensordot(mel_phase_spectrograms, self.constant("mel_to_linear_weight_matrix_float64"), axes=1)
+        phase_spectrograms = tf.cast(tf.mod(phase_spectrograms, 2.0 * np.pi), tf.float32)
+
+        stfts = tf.complex(magnitudes, 0.0) * tf.complex(tf.cos(phase_spectrograms), tf.sin(phase_spectrograms))
+
+        # discard_dc
+        stfts = tf.pad(stfts, [[0, 0], [0, 0], [1, 0]])
+        # same as `tf.signal.inverse_stft` but the overlap-add tail is carried to the next chunk
+        frames = tf.signal.irfft(stfts, fft_length=[self.frame_length])
+        frames *= self.constant("inverse_window")
+        waveforms = tf.signal.overlap_and_add(frames, self.frame_step)
+        waveforms += tf.pad(overlaps, [[0, 0], [0, tf.shape(waveforms)[-1] - (self.frame_length - self.frame_step)]])
+
+        block_length = self.frame_step * tf.shape(frames)[-2]
+        waveform_blocks = waveforms[:, :block_length]
+        overlaps = waveforms[:, block_length:]
+
+        return waveform_blocks, mel_phases, overlaps
+
+    def stream_waveforms(self, session, chunks):
+
+        # drive `convert_to_waveform_block` over an iterable of
+        # (log_mel_magnitude_spectrograms, mel_instantaneous_frequencies) numpy chunks
+        # and yield audio blocks as soon as each chunk is converted
+        # the front padding added by `convert_to_spectrogram` is dropped
+        # so that a single full-length chunk gives the same output as `convert_to_waveform`
+
+        # the placeholders and the conversion are built once per graph and just fed on later calls
+        # so that a long-running renderer doesn't keep growing the graph
+        if session.graph not in self.streams:
+            with session.graph.as_default(), tf.name_scope("stream_waveforms"):
+                log_mel_magnitude_spectrograms = tf.placeholder(tf.float32, [None, None, self.num_freq_bins])
+                mel_instantaneous_frequencies = tf.placeholder(tf.float32, [None, None, self.num_freq_bins])
+                mel_phases = tf.placeholder(tf.float64, [None, self.num_freq_bins])
+                overlaps = tf.placeholder(tf.float32, [None, self.frame_length - self.frame_step])
+                outputs = self.convert_to_waveform_block(log_mel_magnitude_spectrograms, mel_instantaneous_frequencies, mel_phases, overlaps)
+            self.streams[session.graph] = (log_mel_magnitude_spectrograms, mel_instantaneous_frequencies, mel_phases, overlaps), outputs
+        (log_mel_magnitude_spectrograms, mel_instantaneous_frequencies, mel_phases, overlaps), outputs = self.streams[session.graph]
+
+        trim_length = self.num_samples - self.waveform_length
+        states = None
+        for log_mel_magnitude_spectrogram_chunk, mel_instantaneous_frequency_chunk in chunks:
+            if states is None:
+                batch_size = len(log_mel_magnitude_spectrogram_chunk)
+                states = (
+                    np.zeros([batch_size, self.num_freq_bins], dtype=np.float64),
+                    np.zeros([batch_size, self.frame_length - self.frame_step], dtype=np.float32)
+                )
+            waveform_blocks, *states = session.run(outputs, feed_dict={
+                log_mel_magnitude_spectrograms: log_mel_magnitude_spectrogram_chunk,
+                mel_instantaneous_frequencies: mel_instantaneous_frequency_chunk,
+                mel_phases: states[0],
+                overlaps: states[1]
+            })
+            # the front padding may span several chunks
+            waveform_blocks, trim_length = waveform_blocks[:, trim_length:], max(0, trim_length - waveform_blocks.shape[-1])
+            if waveform_blocks.size:
+                yield waveform_blocks
+
+        # flush the remaining overlap-add tail
+        if states is not None:
+            yield states[1][:, trim_length:]
+
+
+spectral_transforms = {}
+
+
+def get_spectral_transform(waveform_length, sample_rate, spectrogram_shape, overlap):
+    # one transform per `spectral_params` shared by every model in the process
+    key = (waveform_length, sample_rate, tuple(spectrogram_shape), overlap)
+    if key not in spectral_transforms:
+        spectral_transforms[key] = SpectralTransform(*key)
+    return spectral_transforms[key]
 
-    return waveforms
+
+def convert_to_spectrogram(waveforms, waveform_length, sample_rate, spectrogram_shape, overlap):
+    spectral_transform = get_spectral_transform(waveform_length, sample_rate, spectrogram_shape, overlap)
+    return spectral_transform.convert_to_spectrogram(waveforms)
+
+
+def convert_to_waveform(log_mel_magnitude_spectrograms, mel_instantaneous_frequencies, waveform_length, sample_rate, spectrogram_shape, overlap):
+    spectral_transform = get_spectral_transform(waveform_length, sample_rate, spectrogram_shape, overlap)
+    return spectral_transform.convert_to_waveform(log_mel_magnitude_spectrograms, mel_instantaneous_frequencies)
+
+
+def stream_waveforms(session, chunks, waveform_length, sample_rate, spectrogram_shape, overlap):
+    spectral_transform = get_spectral_transform(waveform_length, sample_rate, spectrogram_shape, overlap)
+    return spectral_transform.stream_waveforms(session, chunks)
 
 
 def cross_correlation(x, y, padding="VALID", normalize=True):
 
+    # batched FFT-based cross-correlation, equivalent to `tf.nn.conv2d` of `x` with the filter `y`
+    # O(N log N) per pair and vectorized across the batch
+
     if normalize:
         x = tf.nn.l2_normalize(x, axis=-1)
         y = tf.nn.l2_normalize(y, axis=-1)
 
-    x = x[..., tf.newaxis, tf.newaxis]
-    y = y[..., tf.newaxis, tf.newaxis]
-
-    cross_correlations = tf.map_fn(
-        fn=lambda inputs: tf.squeeze(tf.nn.conv2d(
-            input=inputs[0][tf.newaxis, ...],
-            filter=inputs[1][..., tf.newaxis],
-            strides=[1, 1, 1, 1],
-            padding=padding,
-            data_format="NHWC",
-        )),
-        elems=(x, y),
-        dtype=tf.float32,
-        swap_memory=True
-    )
+    x_length = x.shape[-1].value
+    y_length = y.shape[-1].value
+    fft_length = 1 << (x_length + y_length - 2).bit_length()
 
-    return cross_correlations
+    x_ffts = tf.signal.rfft(x, fft_length=[fft_length])
+    y_ffts = tf.signal.rfft(y, fft_length=[fft_length])
+    # circular cross-correlation where index `i` holds lag `i` (mod `fft_length`)
+    cross_correlations = tf.signal.irfft(x_ffts * tf.conj(y_ffts), fft_length=[fft_length])
 
+    if padding == "VALID":
+        cross_correlations = cross_correlations[..., :x_length - y_length + 1]
+    elif padding == "SAME":
+        cross_correlations = tf.roll(cross_correlations, shift=(y_length - 1) // 2, axis=-1)
+        cross_correlations = cross_correlations[..., :x_length]
+    else:
+        raise ValueError(f"invalid padding: {padding}")
 
-if __name__ == "__main__":
-
-    from dataset import nsynth_input_fn
-    import matplotlib.pyplot as plt
-
-    tf.logging.set_verbosity(tf.logging.INFO)
-
-    originals, labels = nsynth_input_fn(
-        filenames=glob.glob("nsynth*.tfrecord"),
-        batch_size=100,
-        num_epochs=1,
-        shuffle=False,
-        pitches=range(24, 85),
-        sources=[0]
-    )
-
-    reconstructions = convert_to_waveform(
-        *convert_to_spectrogram(
-            waveforms=originals,
-            waveform_length=64000,
-            sample_rate=16000,
-            spectrogram_shape=[128, 1024],
-            overlap=0.75
-        ),
-        waveform_length=64000,
-        sample_rate=16000,
-        spectrogram_shape=[128, 1024],
-        overlap=0.75
-    )
-
-    cross_correlations = cross_correlation(originals, reconstructions)
-
-    with tf.train.SingularMonitoredSession(
-        scaffold=tf.train.Scaffold(
-            init_op=tf.global_variables_initializer(),
-            local_init_op=tf.group(
-                tf.local_variables_initializer(),
-                tf.tables_initializer()
-            )
-        )
-    ) as session:
+    # squeeze like `tf.squeeze` of the conv2d output
+    if cross_correlations.shape[-1].value == 1:
+        cross_correlations = tf.squeeze(cross_correlations, axis=-1)
 
-        def generator():
-            while True:
-                try:
-                    yield session.run([cross_correlations])
-                except tf.errors.OutOfRangeError:
-                    break
+    return cross_correlations
 
-        plt.hist(*map(np.concatenate, zip(*generator())), bins=20, range=[-1.0, 1.0])
-        plt.show()
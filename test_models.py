@@ -0,0 +1,84 @@
+import tensorflow as tf
+import numpy as np
+import threading
+from models import CombinedOptimizer
+
+# synchronous data-parallel updates on a localhost cluster (`python -m pytest test_models.py`)
+
+
+def test_combined_sync_replicas_optimizer():
+
+    num_workers = 2
+    num_steps = 10
+    workers, _ = tf.test.create_local_cluster(num_workers=num_workers, num_ps=1)
+    errors = []
+
+    def build(task_index):
+
+        with tf.device(tf.train.replica_device_setter(
+            worker_device=f"/job:worker/task:{task_index}",
+            ps_device="/job:ps/task:0"
+        )):
+            global_step = tf.train.get_or_create_global_step()
+            with tf.variable_scope("generator"):
+                generator_variable = tf.Variable(0.0, name="variable")
+            with tf.variable_scope("discriminator"):
+                discriminator_variable = tf.Variable(0.0, name="variable")
+
+        return global_step, generator_variable, discriminator_variable
+
+    def train(task_index):
+
+        try:
+            with tf.Graph().as_default():
+                global_step, generator_variable, discriminator_variable = build(task_index)
+                # unit gradients with different learning rates, so that each update moves
+                # the generator by 1 and the discriminator by 2 once the gradients of every worker are aggregated
+                generator_optimizer = tf.train.GradientDescentOptimizer(1.0)
+                discriminator_optimizer = tf.train.GradientDescentOptimizer(2.0)
+                sync_optimizer = tf.train.SyncReplicasOptimizer(
+                    opt=CombinedOptimizer([
+                        (generator_optimizer, [generator_variable]),
+                        (discriminator_optimizer, [discriminator_variable])
+                    ]),
+                    replicas_to_aggregate=num_workers,
+                    total_num_replicas=num_workers
+                )
+                train_op = sync_optimizer.apply_gradients(
+                    grads_and_vars=(
+                        generator_optimizer.compute_gradients(generator_variable, var_list=[generator_variable]) +
+                        discriminator_optimizer.compute_gradients(discriminator_variable, var_list=[discriminator_variable])
+                    ),
+                    global_step=global_step
+                )
+                with tf.train.MonitoredTrainingSession(
+                    master=workers[task_index].target,
+                    is_chief=task_index == 0,
+                    hooks=[
+                        sync_optimizer.make_session_run_hook(task_index == 0),
+                        tf.train.StopAtStepHook(last_step=num_steps)
+                    ]
+                ) as session:
+                    while not session.should_stop():
+                        session.run(train_op)
+        except Exception as exception:
+            errors.append(exception)
+
+    threads = [threading.Thread(target=train, args=(task_index,), daemon=True) for task_index in range(num_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=120)
+
+    assert not any(thread.is_alive() for thread in threads), "the workers deadlocked"
+    assert not errors, errors
+
+    # every step updated both networks exactly once
+    # (the variables live on the parameter server, so a new session reads their final values)
+    with tf.Graph().as_default():
+        variables = build(0)
+        with tf.Session(workers[0].target) as session:
+            global_step, generator_value, discriminator_value = session.run(variables)
+    assert global_step == num_steps
+    np.testing.assert_allclose(generator_value, -1.0 * num_steps)
+    np.testing.assert_allclose(discriminator_value, -2.0 * num_steps)
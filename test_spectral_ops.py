@@ -0,0 +1,175 @@
+import tensorflow as tf
+import numpy as np
+import subprocess
+import pytest
+import sys
+import os
+import spectral_ops
+import numpy_spectral_ops
+
+# the NumPy / SciPy backend against the TensorFlow one (`python -m pytest test_spectral_ops.py`)
+
+spectral_params = dict(
+    waveform_length=64000,
+    sample_rate=16000,
+    spectrogram_shape=[128, 1024],
+    overlap=0.75
+)
+
+
+@pytest.fixture(scope="module")
+def waveforms():
+    # decaying harmonic tones
+    times = np.arange(spectral_params["waveform_length"]) / spectral_params["sample_rate"]
+    return np.stack([
+        sum(np.sin(2.0 * np.pi * 440.0 * 2.0 ** ((pitch - 69) / 12.0) * harmonic * times) / harmonic for harmonic in range(1, 5))
+        * np.exp(-times) * 0.25 for pitch in range(24, 85, 12)
+    ]).astype(np.float32)
+
+
+def run(function, *inputs):
+    with tf.Graph().as_default():
+        outputs = function(*map(tf.constant, inputs), **spectral_params)
+        with tf.Session() as session:
+            return session.run(outputs)
+
+
+def test_mel_weight_matrices(tmp_path):
+
+    # both backends share the NumPy port, so check it against the TensorFlow ops it replaced
+    tfp = pytest.importorskip("tensorflow_probability")
+
+    num_freq_bins = spectral_params["spectrogram_shape"][1]
+    sample_rate = spectral_params["sample_rate"]
+    linear_to_mel_weight_matrix, mel_to_linear_weight_matrix = numpy_spectral_ops.mel_weight_matrices(
+        sample_rate=sample_rate,
+        num_freq_bins=num_freq_bins,
+        cache_dir=str(tmp_path)
+    )
+
+    with tf.Graph().as_default():
+        expected_linear_to_mel_weight_matrix = tf.signal.linear_to_mel_weight_matrix(
+            num_mel_bins=num_freq_bins,
+            num_spectrogram_bins=num_freq_bins,
+            sample_rate=sample_rate,
+            lower_edge_hertz=0.0,
+            upper_edge_hertz=sample_rate / 2.0
+        )
+        expected_mel_to_linear_weight_matrix = tfp.math.pinv(expected_linear_to_mel_weight_matrix)
+        with tf.Session() as session:
+            expected_linear_to_mel_weight_matrix, expected_mel_to_linear_weight_matrix = session.run([
+                expected_linear_to_mel_weight_matrix,
+                expected_mel_to_linear_weight_matrix
+            ])
+
+    assert linear_to_mel_weight_matrix.shape == expected_linear_to_mel_weight_matrix.shape == (num_freq_bins, num_freq_bins)
+    np.testing.assert_allclose(linear_to_mel_weight_matrix, expected_linear_to_mel_weight_matrix, atol=1e-6)
+    assert mel_to_linear_weight_matrix.shape == expected_mel_to_linear_weight_matrix.shape
+    np.testing.assert_allclose(
+        mel_to_linear_weight_matrix, expected_mel_to_linear_weight_matrix,
+        atol=1e-4 * np.abs(expected_mel_to_linear_weight_matrix).max()
+    )
+
+
+def test_convert_to_spectrogram(waveforms):
+
+    pytest.importorskip("scipy")
+
+    magnitude_spectrograms, instantaneous_frequencies = numpy_spectral_ops.convert_to_spectrogram(waveforms, **spectral_params)
+    expected_magnitude_spectrograms, expected_instantaneous_frequencies = run(spectral_ops.convert_to_spectrogram, waveforms)
+
+    assert magnitude_spectrograms.shape == expected_magnitude_spectrograms.shape == (len(waveforms), 128, 1024)
+    np.testing.assert_allclose(magnitude_spectrograms, expected_magnitude_spectrograms, atol=1e-4)
+    np.testing.assert_allclose(instantaneous_frequencies, expected_instantaneous_frequencies, atol=1e-4)
+
+
+def test_convert_to_waveform(waveforms):
+
+    pytest.importorskip("scipy")
+
+    spectrograms = run(spectral_ops.convert_to_spectrogram, waveforms)
+    reconstructions = numpy_spectral_ops.convert_to_waveform(*spectrograms, **spectral_params)
+    expected_reconstructions = run(spectral_ops.convert_to_waveform, *spectrograms)
+
+    assert reconstructions.shape == expected_reconstructions.shape == waveforms.shape
+    np.testing.assert_allclose(reconstructions, expected_reconstructions, atol=1e-5)
+
+
+def test_spectral_ops_without_scipy():
+
+    # `spectral_ops` shares the constants of `numpy_spectral_ops` but mustn't need SciPy
+    subprocess.run([sys.executable, "-c", "\n".join([
+        "import sys",
+        "sys.modules['scipy'] = None",
+        "import spectral_ops",
+        "import numpy_spectral_ops",
+        "numpy_spectral_ops.spectral_constants(16000, (128, 1024), 0.75)",
+    ])], cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+
+def test_stream_waveforms(waveforms):
+
+    spectrograms = run(spectral_ops.convert_to_spectrogram, waveforms)
+    expected_reconstructions = run(spectral_ops.convert_to_waveform, *spectrograms)
+
+    log_mel_magnitude_spectrograms, mel_instantaneous_frequencies = spectrograms
+    num_ops = []
+    with tf.Graph().as_default() as graph:
+        with tf.Session() as session:
+            for chunk_size in [1, 7, 32, 128]:
+                chunks = [
+                    (log_mel_magnitude_spectrograms[:, i:i + chunk_size], mel_instantaneous_frequencies[:, i:i + chunk_size])
+                    for i in range(0, log_mel_magnitude_spectrograms.shape[1], chunk_size)
+                ]
+                reconstructions = np.concatenate(list(spectral_ops.stream_waveforms(session, chunks, **spectral_params)), axis=-1)
+                num_ops.append(len(graph.get_operations()))
+                # the output of `convert_to_waveform` followed by the overlap-add tail of the last frame
+                assert reconstructions.shape[-1] > expected_reconstructions.shape[-1]
+                np.testing.assert_allclose(reconstructions[:, :expected_reconstructions.shape[-1]], expected_reconstructions, atol=1e-4)
+
+    # the streaming subgraph is built by the first call and just fed by the later ones
+    assert len(set(num_ops)) == 1
+
+
+def test_stream_waveforms_precision():
+
+    # the cumulative phase of a long render (8192 frames, about 4 minutes) against a float64 NumPy reference
+    # of the last frames, which the float32 phase carried across chunks failed to match
+    pytest.importorskip("scipy")
+
+    spectral_transform = spectral_ops.get_spectral_transform(**spectral_params)
+    num_frames, chunk_size = 8192, 128
+    random = np.random.RandomState(0)
+    # unit mel magnitudes (log 0.0 normalized) and random IF in [0.25, 0.75)
+    log_mel_magnitude_spectrograms = np.full([1, num_frames, spectral_transform.num_freq_bins], 3.76 / 10.05, dtype=np.float32)
+    mel_instantaneous_frequencies = random.uniform(0.25, 0.75, [1, num_frames, spectral_transform.num_freq_bins]).astype(np.float32)
+
+    with tf.Graph().as_default():
+        with tf.Session() as session:
+            chunks = [
+                (log_mel_magnitude_spectrograms[:, i:i + chunk_size], mel_instantaneous_frequencies[:, i:i + chunk_size])
+                for i in range(0, num_frames, chunk_size)
+            ]
+            reconstructions = np.concatenate(list(spectral_ops.stream_waveforms(session, chunks, **spectral_params)), axis=-1)
+
+    # the last `num_reference_frames` frames in float64, whose overlap-add is complete after their first 3 frames
+    num_reference_frames = chunk_size + 3
+    frame_step = spectral_transform.frame_step
+    mel_to_linear_weight_matrix = spectral_transform.mel_to_linear_weight_matrix.astype(np.float64)
+    mel_phase_spectrograms = np.cumsum(mel_instantaneous_frequencies.astype(np.float64) * np.pi, axis=-2)[:, -num_reference_frames:]
+    phase_spectrograms = mel_phase_spectrograms @ mel_to_linear_weight_matrix
+    magnitudes = np.ones_like(mel_phase_spectrograms) @ mel_to_linear_weight_matrix
+    stfts = np.pad(magnitudes * np.exp(1j * phase_spectrograms), [[0, 0], [0, 0], [1, 0]], mode="constant")
+    expected_reconstructions = numpy_spectral_ops.inverse_stft(
+        stfts,
+        spectral_transform.frame_length,
+        frame_step,
+        spectral_transform.inverse_window.astype(np.float64)
+    )[:, 3 * frame_step:]
+
+    start = (num_frames - num_reference_frames + 3) * frame_step - (spectral_transform.num_samples - spectral_transform.waveform_length)
+    assert reconstructions.shape[-1] - start == expected_reconstructions.shape[-1]
+    np.testing.assert_allclose(
+        reconstructions[:, start:], expected_reconstructions,
+        atol=1e-4 * np.abs(expected_reconstructions).max()
+    )